@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Offline benchmarks of the nessus-* modules. A fake Nessus.sc
+# (fake_sc.py) is started in this process and every module run is a child
+# process started through run_module.py, so its wall time and peak RSS
+# (wait4) are its own. API calls are counted by the fake server.
+#
+#   python3 benchmarks/bench.py                    # small data set
+#   python3 benchmarks/bench.py --scale large      # 50k scan results, 5k asset lists, multi-GB exports
+#   python3 benchmarks/bench.py --latency 50 --repeat 5 --json before.json
+#
+# Every fake_sc.py option (--scan-results, --report-hosts, --latency,
+# --error-rate, ...) is accepted. Needs ansible and pyTenable installed.
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    sys.exit('bench.py needs Python 3')
+
+import fake_sc
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MODULES = ['create-assets', 'create-scan', 'launch-scan', 'fetch-scan', 'pipeline']
+
+SCALES = dict(
+    small=dict(scans=500, scan_results=5000, asset_lists=500, report_hosts=1000, report_items=20, csv_rows=5000),
+    large=dict(scans=5000, scan_results=50000, asset_lists=5000, report_hosts=200000, report_items=40,
+               csv_rows=200000)
+    )
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, parents=[fake_sc.argument_parser(add_help=False)],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                        help='data set preset, explicit options override it')
+    parser.add_argument('--csv-rows', type=int, help='rows of the CSV file given to nessus-create-assets')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every module')
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=MODULES)
+    parser.add_argument('--python', default=sys.executable, help='interpreter running the modules')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the work folder (reports, args files)')
+    parser.set_defaults(port=0, queue_time=1, scan_time=3)
+    return parser
+
+
+def parse_args():
+    parser = argument_parser()
+    scale = parser.parse_known_args()[0].scale
+    parser.set_defaults(**SCALES[scale])
+    return parser.parse_args()
+
+
+class Bench(object):
+    ''' Fake server, work folder and module runs of one benchmark session '''
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.workdir = tempfile.mkdtemp(prefix='nessus-bench-')
+        self.server = fake_sc.make_server(opts)
+        self.port = self.server.server_address[1]
+        self.scheme = 'http' if opts.plain_http else 'https'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.context = ssl._create_unverified_context()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        if not self.opts.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def bench_call(self, path, method='GET'):
+        req = Request(self.scheme + '://127.0.0.1:' + str(self.port) + '/_bench/' + path, method=method,
+                      data=b'' if method == 'POST' else None)
+        return json.loads(urlopen(req, context=self.context).read().decode('utf-8'))
+
+    def common_args(self):
+        return dict(server='127.0.0.1', port=self.port, nessus_username='api_bench', nessus_password='bench-password',
+                    cache_dir=os.path.join(self.workdir, 'cache'))
+
+    def write_csv(self):
+        path = os.path.join(self.workdir, 'assets.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['hostname', 'ip', 'group'])
+            for n in range(self.opts.csv_rows):
+                writer.writerow(['host%d.bench.local' % n, '172.%d.%d.%d' % (16 + (n >> 16) % 16, (n >> 8) & 255,
+                                                                             n & 255), 'group-%d' % (n % 10)])
+        return path
+
+    def run(self, module, args):
+        ''' Run module with args, returning its result, wall time, peak RSS and API calls served '''
+        args_path = os.path.join(self.workdir, 'args.json')
+        with open(args_path, 'w') as f:
+            json.dump(dict(ANSIBLE_MODULE_ARGS=args), f)
+
+        self.bench_call('reset', 'POST')
+        started = time.time()
+        with open(os.path.join(self.workdir, 'stderr.log'), 'wb') as stderr:
+            proc = subprocess.Popen([self.opts.python, os.path.join(HERE, 'run_module.py'), module, args_path],
+                                    cwd=self.workdir, stdout=subprocess.PIPE, stderr=stderr)
+            output = proc.stdout.read()
+            _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.time() - started
+        proc.returncode = status
+        stats = self.bench_call('stats')['stats']
+
+        try:
+            result = json.loads(output.decode('utf-8'))
+        except ValueError:
+            with open(os.path.join(self.workdir, 'stderr.log'), 'rb') as f:
+                result = dict(failed=True, msg=(output + f.read()).decode('utf-8', 'replace')[-2000:])
+        return dict(
+            result=result,
+            wall_time=wall,
+            # ru_maxrss is in kilobytes on Linux
+            peak_rss_mb=rusage.ru_maxrss / 1024.0,
+            api_calls=sum(s['count'] for s in stats.values()),
+            api_bytes=sum(s['bytes'] for s in stats.values()),
+            endpoints=dict((name, s['count']) for name, s in stats.items())
+            )
+
+    def scenarios(self, n):
+        ''' (name, module file, args) of the n-th run of every module, each run using its own names '''
+        csv_path = self.csv_path
+        scan_name = 'bench-run-%d-%d' % (os.getpid(), n)
+        common = self.common_args()
+        yield 'create-assets', 'nessus-create-assets.py', dict(
+            common, asset_name='bench-run-assets-%d' % n, asset_type='ip', file_location=csv_path)
+        yield 'create-scan', 'nessus-create-scan.py', dict(
+            common, scan_name=scan_name, policy_name='bench-policy-001', assets=['bench-run-assets-%d' % n])
+        yield 'launch-scan', 'nessus-launch-scan.py', dict(
+            common, scan_name=scan_name, wait=True, poll_interval=1, max_poll_interval=2)
+        yield 'fetch-scan', 'nessus-fetch-scan.py', dict(
+            common, scan_name='bench-scan-00001', incremental=False, findings_format='jsonl')
+        # the four steps above as a single task
+        yield 'pipeline', 'nessus-sc-pipeline.py', dict(
+            common, asset_name='bench-pipeline-assets-%d' % n, asset_type='ip', file_location=csv_path,
+            scan_name=scan_name + '-pipeline', policy_name='bench-policy-001', poll_interval=1,
+            max_poll_interval=2, incremental=False, findings_format='jsonl')
+
+    def run_all(self):
+        self.csv_path = self.write_csv()
+        runs = dict((name, []) for name in MODULES)
+        for n in range(self.opts.repeat):
+            for name, module, args in self.scenarios(n):
+                if name not in self.opts.modules:
+                    continue
+                run = self.run(module, args)
+                runs[name].append(run)
+                if run['result'].get('failed'):
+                    print('%s run %d failed: %s' % (name, n + 1, run['result'].get('msg')), file=sys.stderr)
+        return dict((name, runs[name]) for name in self.opts.modules)
+
+
+def summarize(runs):
+    walls = [run['wall_time'] for run in runs]
+    return dict(
+        runs=len(runs),
+        failed=sum(1 for run in runs if run['result'].get('failed')),
+        wall_median=statistics.median(walls),
+        wall_min=min(walls),
+        api_calls=statistics.median(run['api_calls'] for run in runs),
+        api_mb=statistics.median(run['api_bytes'] for run in runs) / 1048576.0,
+        peak_rss_mb=max(run['peak_rss_mb'] for run in runs),
+        endpoints=runs[-1]['endpoints']
+        )
+
+
+def main():
+    opts = parse_args()
+    bench = Bench(opts)
+    bench.start()
+    try:
+        runs = bench.run_all()
+    finally:
+        bench.stop()
+
+    summary = dict((name, summarize(module_runs)) for name, module_runs in runs.items())
+    print('%-14s %5s %6s %10s %10s %9s %9s %10s' % (
+        'module', 'runs', 'failed', 'wall med', 'wall min', 'api calls', 'api MB', 'peak RSS'))
+    for name, s in summary.items():
+        print('%-14s %5d %6d %9.2fs %9.2fs %9d %9.1f %8.1fMB' % (
+            name, s['runs'], s['failed'], s['wall_median'], s['wall_min'], s['api_calls'], s['api_mb'],
+            s['peak_rss_mb']))
+
+    if opts.json:
+        settings = dict((key, value) for key, value in vars(opts).items() if key not in ('json', 'python'))
+        with open(opts.json, 'w') as f:
+            json.dump(dict(settings=settings, summary=summary, runs=runs), f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
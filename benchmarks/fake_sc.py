@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Local stand-in for the Nessus.sc REST API, good enough to run the
+# nessus-* modules against it: token, system, currentUser, scan,
+# scanResult (list, details, download), asset, policy and credential.
+# Objects are synthetic and generated at start up at the requested scale;
+# scan exports are generated and zipped on the fly, so their size is only
+# bounded by the time the client spends reading them.
+#
+#   python3 benchmarks/fake_sc.py --port 8443 --scan-results 50000 --asset-lists 5000
+#
+# GET /_bench/stats returns the calls served per endpoint, POST
+# /_bench/reset clears them.
+
+import argparse
+import ipaddress
+import json
+import os
+import random
+import re
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    sys.exit('fake_sc.py needs Python 3')
+
+
+DAY = 86400
+STREAM_CHUNK = 256 * 1024
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def ip_of(number):
+    return '10.%d.%d.%d' % ((number >> 16) & 255, (number >> 8) & 255, number & 255)
+
+
+def valid_reference(value):
+    ''' True for an object reference the way SC takes it: {"id": <number>} '''
+    return isinstance(value, dict) and str(value.get('id', '')).isdigit()
+
+
+def count_hosts(defined):
+    ''' Addresses in a comma separated list of ips, CIDRs and hostnames '''
+    hosts = 0
+    for target in re.split(r'[,\s]+', defined or ''):
+        if '/' in target:
+            try:
+                hosts += ipaddress.ip_network(target, strict=False).num_addresses
+                continue
+            except ValueError:
+                pass
+        hosts += 1 if target else 0
+    return hosts
+
+
+class FakeSC(object):
+    ''' Synthetic Nessus.sc objects and the state of the scans launched against them '''
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.stats = {}
+        self.next_id = 1
+        rand = random.Random(opts.seed)
+        now = int(time.time())
+
+        self.policies = self._seed('bench-policy-%03d', opts.policies)
+        self.credentials = self._seed('bench-credential-%03d', opts.credentials)
+        self.assets = {}
+        for n in range(opts.asset_lists):
+            asset_id = self._id()
+            self.assets[asset_id] = dict(id=str(asset_id), name='bench-assets-%05d' % (n + 1), type='static',
+                                         definedIPs=','.join(ip_of(n * 256 + h) for h in range(opts.asset_size)),
+                                         definedDNSNames='')
+        self.scans = {}
+        for n in range(opts.scans):
+            scan_id = self._id()
+            self.scans[scan_id] = dict(id=str(scan_id), name='bench-scan-%05d' % (n + 1),
+                                       policy=dict(id=str(min(self.policies))), repository=dict(id='1'),
+                                       ipList=ip_of(n * 256) + '/24', assets=[])
+        self.results = {}
+        names = [scan['name'] for scan in self.scans.values()] or ['bench-scan']
+        for n in range(opts.scan_results):
+            created = now - rand.randint(0, 365 * DAY)
+            self._add_result(names[n % len(names)], created, created, created + 3600, 'Completed', opts.report_hosts)
+
+    def _id(self):
+        with self.lock:
+            value = self.next_id
+            self.next_id += 1
+            return value
+
+    def _seed(self, template, count):
+        items = {}
+        for n in range(count):
+            object_id = self._id()
+            items[object_id] = dict(id=str(object_id), name=template % (n + 1))
+        return items
+
+    def _add_result(self, name, created, start, finish, status, hosts, launched=None):
+        result_id = self._id()
+        self.results[result_id] = dict(
+            id=str(result_id), name=name, status=status, createdTime=str(created), startTime=str(start),
+            finishTime=str(finish), totalIPs=str(hosts), scannedIPs=str(hosts), completedIPs=str(hosts),
+            launched=launched)
+        return result_id
+
+    def result_state(self, result):
+        ''' Scan result as seen now, moving launched scans through Queued, Running and Completed '''
+        result = dict(result)
+        launched = result.pop('launched')
+        if launched is None:
+            return result
+        elapsed = time.time() - launched
+        total = int(result['totalIPs'])
+        queued = self.opts.queue_time
+        if elapsed < queued:
+            result.update(status='Queued', startTime='-1', finishTime='-1', completedIPs='0', scannedIPs='0')
+        elif elapsed < queued + self.opts.scan_time:
+            done = str(int(total * (elapsed - queued) / self.opts.scan_time))
+            result.update(status='Running', startTime=str(int(launched + queued)), finishTime='-1',
+                          completedIPs=done, scannedIPs=done)
+        else:
+            result.update(status='Completed', startTime=str(int(launched + queued)),
+                          finishTime=str(int(launched + queued + self.opts.scan_time)))
+        return result
+
+    def count(self, endpoint, sent=0):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, dict(count=0, bytes=0))
+            stats['count'] += 1
+            stats['bytes'] += sent
+
+
+def select_fields(item, fields):
+    if not fields:
+        return item
+    wanted = set(fields.split(',')) | set(['id'])
+    return dict((key, value) for key, value in item.items() if key in wanted)
+
+
+def listing(items, fields):
+    usable = [select_fields(item, fields) for item in items]
+    return dict(usable=usable, manageable=usable)
+
+
+def report_hosts(result_id, hosts, items, rand):
+    ''' .nessus XML of a scan result, yielded host by host '''
+    yield ('<?xml version="1.0" ?>\n<NessusClientData_v2>\n<Report name="bench-%d" '
+           'xmlns:cm="http://www.nessus.org/cm">\n' % result_id).encode('utf-8')
+    for h in range(hosts):
+        ip = ip_of(h)
+        parts = ['<ReportHost name="host%d.bench.local"><HostProperties>'
+                 '<tag name="host-ip">%s</tag><tag name="HOST_END">Mon Jan  1 00:00:00 2024</tag>'
+                 '</HostProperties>\n' % (h, ip)]
+        for i in range(items):
+            plugin = 10000 + rand.randint(0, 90000)
+            parts.append(
+                '<ReportItem port="%d" svc_name="www" protocol="tcp" severity="%d" pluginID="%d" '
+                'pluginName="Bench plugin %d" pluginFamily="General"><description>Synthetic finding %d '
+                'of host %s used by the nessus-* benchmarks.</description><solution>Upgrade.</solution>'
+                '<risk_factor>Medium</risk_factor><cve>CVE-2020-%04d</cve></ReportItem>\n'
+                % (rand.choice((22, 80, 443, 445, 3389)), rand.randint(0, 4), plugin, plugin, i, ip, i % 10000))
+        parts.append('</ReportHost>\n')
+        yield ''.join(parts).encode('utf-8')
+    yield b'</Report>\n</NessusClientData_v2>\n'
+
+
+def zip_stream(name, chunks, level=1):
+    ''' Streaming zip64 archive holding name, written with a data descriptor as the
+    export of SC is: sizes and CRC only follow the compressed data '''
+    raw_name = name.encode('utf-8')
+    zip64_extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+    yield struct.pack('<IHHHHHIIIHH', 0x04034b50, 45, 0x08, 8, 0, 0, 0, 0xFFFFFFFF, 0xFFFFFFFF,
+                      len(raw_name), len(zip64_extra)) + raw_name + zip64_extra
+
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    csize = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = deflate.compress(chunk)
+        if data:
+            csize += len(data)
+            yield data
+    data = deflate.flush()
+    csize += len(data)
+    crc &= 0xFFFFFFFF
+    yield data + struct.pack('<IIQQ', 0x08074b50, crc, csize, size)
+
+    offset = 30 + len(raw_name) + len(zip64_extra) + csize + 24
+    central_extra = struct.pack('<HHQQQ', 0x0001, 24, size, csize, 0)
+    central = struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 45, 45, 0x08, 8, 0, 0, crc, 0xFFFFFFFF,
+                          0xFFFFFFFF, len(raw_name), len(central_extra), 0, 0, 0, 0, 0) + raw_name + central_extra
+    end64 = struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, 1, 1, len(central), offset)
+    locator = struct.pack('<IIQI', 0x07064b50, 0, offset + len(central), 1)
+    end = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 1, 1, len(central), 0xFFFFFFFF, 0)
+    yield central + end64 + locator + end
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeSC/1.0'
+    sc = None
+
+    def log_message(self, format, *args):
+        if self.sc.opts.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(data.decode('utf-8')) if data else {}
+        except ValueError:
+            return {}
+
+    def send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def respond(self, response, status=200, headers=None):
+        return self.send_json(dict(type='regular', response=response, error_code=0, error_msg='',
+                                   warnings=[], timestamp=int(time.time())), status, headers)
+
+    def error(self, status, message, headers=None):
+        return self.send_json(dict(type='regular', response='', error_code=status, error_msg=message,
+                                   warnings=[], timestamp=int(time.time())), status, headers)
+
+    def dispatch(self, method):
+        sc = self.sc
+        url = urlparse(self.path)
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts[:1] == ['_bench']:
+            if parts[1:] == ['reset'] and method == 'POST':
+                with sc.lock:
+                    sc.stats = {}
+                self.send_json({})
+            else:
+                with sc.lock:
+                    self.send_json(dict(stats=sc.stats, objects=dict(
+                        scans=len(sc.scans), scan_results=len(sc.results), asset_lists=len(sc.assets))))
+            return
+
+        if parts[:1] != ['rest'] or len(parts) < 2:
+            self.error(404, 'Not found')
+            return
+        resource = parts[1]
+        object_id = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
+        action = parts[3] if len(parts) > 3 else None
+        endpoint = method + ' ' + resource + ('/{id}' if object_id is not None else '') + ('/' + action if action else '')
+        body = self.body() if method in ('POST', 'PATCH') else {}
+
+        if sc.opts.latency:
+            time.sleep(max(0.0, random.gauss(sc.opts.latency, sc.opts.latency * sc.opts.jitter)) / 1000.0)
+
+        if resource not in ('token', 'system') and random.random() < sc.opts.error_rate:
+            status = random.choice((429, 502, 503))
+            sc.count(endpoint + ' [' + str(status) + ']', self.error(status, 'Injected error', {'Retry-After': '1'}))
+            return
+
+        if resource not in ('token', 'system') and self.headers.get('X-SecurityCenter') not in sc.tokens:
+            sc.count(endpoint + ' [401]', self.error(401, 'Invalid token'))
+            return
+
+        try:
+            sent = self.route(method, resource, object_id, action, query, body)
+        except KeyError:
+            sent = self.error(404, 'Object not found')
+        except Exception as e:
+            sent = self.error(500, str(e))
+        sc.count(endpoint, sent or 0)
+
+    def route(self, method, resource, object_id, action, query, body):
+        sc = self.sc
+        fields = query.get('fields')
+
+        if resource == 'system':
+            return self.respond(dict(version='5.23.1', buildID='202301010000', uuid='bench', licenseStatus='Valid'))
+
+        if resource == 'token':
+            if method == 'DELETE':
+                sc.tokens.discard(self.headers.get('X-SecurityCenter'))
+                return self.respond({})
+            token = str(random.randint(10 ** 8, 10 ** 9))
+            sc.tokens.add(token)
+            return self.respond(dict(token=int(token), unassociatedCert='false'),
+                                headers={'Set-Cookie': 'TNS_SESSIONID=' + token + '; path=/; HttpOnly'})
+
+        if resource == 'currentUser':
+            return self.respond(select_fields(dict(id='1', username='bench'), fields))
+
+        if resource in ('policy', 'credential'):
+            items = sc.policies if resource == 'policy' else sc.credentials
+            if object_id is not None:
+                return self.respond(select_fields(items[object_id], fields))
+            return self.respond(listing(items.values(), fields))
+
+        if resource == 'asset':
+            return self.route_asset(method, object_id, fields, body)
+
+        if resource == 'scan':
+            return self.route_scan(method, object_id, action, fields, body)
+
+        if resource == 'scanResult':
+            return self.route_result(method, object_id, action, query, fields)
+
+        return self.error(404, 'Unknown resource ' + resource)
+
+    def route_asset(self, method, object_id, fields, body):
+        sc = self.sc
+        if method == 'GET':
+            if object_id is not None:
+                return self.respond(select_fields(sc.assets[object_id], fields))
+            return self.respond(listing(sc.assets.values(), fields))
+        if method == 'DELETE':
+            del sc.assets[object_id]
+            return self.respond({})
+        if method == 'PATCH':
+            asset = sc.assets[object_id]
+        else:
+            asset_id = sc._id()
+            asset = sc.assets[asset_id] = dict(id=str(asset_id), name=body.get('name'), type=body.get('type'),
+                                               definedIPs='', definedDNSNames='')
+        for key in ('name', 'definedIPs', 'definedDNSNames', 'combinations', 'description'):
+            if key in body:
+                asset[key] = body[key]
+        return self.respond(asset)
+
+    def route_scan(self, method, object_id, action, fields, body):
+        sc = self.sc
+        if method == 'GET':
+            if object_id is not None:
+                return self.respond(select_fields(sc.scans[object_id], fields))
+            return self.respond(listing(sc.scans.values(), fields))
+        if method == 'DELETE':
+            del sc.scans[object_id]
+            return self.respond({})
+        if action == 'launch':
+            scan = sc.scans[object_id]
+            hosts = count_hosts(scan.get('ipList'))
+            for asset in scan.get('assets') or []:
+                hosts += count_hosts(sc.assets.get(int(asset['id']), {}).get('definedIPs'))
+            now = int(time.time())
+            result_id = sc._add_result(scan['name'], now, -1, -1, 'Queued', max(hosts, 1), launched=time.time())
+            return self.respond(dict(scanID=str(object_id), scanResult=sc.result_state(sc.results[result_id])))
+        # SC only takes object references as {"id": <id>}
+        for key in ('repository', 'zone'):
+            if key in body and not valid_reference(body[key]):
+                return self.error(403, 'Invalid ' + key + ': ' + json.dumps(body[key]))
+        if method == 'PATCH':
+            scan = sc.scans[object_id]
+            for key in ('name', 'policy', 'repository', 'zone', 'ipList', 'assets', 'credentials'):
+                if key in body:
+                    scan[key] = body[key]
+            return self.respond(scan)
+        if 'repository' not in body:
+            return self.error(403, 'Scan repository is required')
+        scan_id = sc._id()
+        scan = sc.scans[scan_id] = dict(id=str(scan_id), name=body.get('name'), policy=body.get('policy'),
+                                        repository=body.get('repository'), zone=body.get('zone'),
+                                        ipList=body.get('ipList', ''), assets=body.get('assets') or [],
+                                        credentials=body.get('credentials') or [])
+        return self.respond(scan)
+
+    def route_result(self, method, object_id, action, query, fields):
+        sc = self.sc
+        if action == 'download':
+            return self.download(object_id)
+        if object_id is not None:
+            if method == 'DELETE':
+                del sc.results[object_id]
+                return self.respond({})
+            return self.respond(select_fields(sc.result_state(sc.results[object_id]), fields))
+
+        start = int(query.get('startTime') or 0)
+        end = int(query.get('endTime') or 2 ** 40)
+        items = [sc.result_state(r) for r in list(sc.results.values()) if start <= int(r['createdTime']) <= end]
+        return self.respond(listing(items, fields))
+
+    def download(self, result_id):
+        ''' Zipped .nessus export of result_id, sent with chunked transfer encoding '''
+        sc = self.sc
+        result = sc.results[result_id]
+        hosts = min(int(result['totalIPs']), sc.opts.report_hosts) if result.get('launched') else sc.opts.report_hosts
+        chunks = report_hosts(result_id, hosts, sc.opts.report_items, random.Random(result_id))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', 'attachment; filename="' + str(result_id) + '.zip"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        sent = 0
+        pending = []
+        pending_size = 0
+        for data in zip_stream(str(result_id) + '.nessus', chunks):
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= STREAM_CHUNK:
+                sent += self.write_chunk(b''.join(pending))
+                pending = []
+                pending_size = 0
+        if pending:
+            sent += self.write_chunk(b''.join(pending))
+        self.wfile.write(b'0\r\n\r\n')
+        return sent
+
+    def write_chunk(self, data):
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+        return len(data)
+
+
+def self_signed_cert(folder):
+    ''' cert and key files of a throw-away localhost certificate, made with the openssl CLI '''
+    cert = os.path.join(folder, 'fake_sc.crt')
+    key = os.path.join(folder, 'fake_sc.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                           '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def argument_parser(add_help=True):
+    parser = argparse.ArgumentParser(description='Fake Nessus.sc REST API for the nessus-* benchmarks',
+                                     add_help=add_help)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--plain-http', action='store_true', help='serve HTTP instead of HTTPS')
+    parser.add_argument('--cert', help='TLS certificate, a self-signed one is generated when missing')
+    parser.add_argument('--key', help='TLS key of --cert')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scans', type=int, default=500)
+    parser.add_argument('--scan-results', type=int, default=5000)
+    parser.add_argument('--asset-lists', type=int, default=500)
+    parser.add_argument('--asset-size', type=int, default=64, help='ips of every seeded asset list')
+    parser.add_argument('--policies', type=int, default=20)
+    parser.add_argument('--credentials', type=int, default=20)
+    parser.add_argument('--report-hosts', type=int, default=1000, help='hosts in every export')
+    parser.add_argument('--report-items', type=int, default=20, help='findings per host in every export')
+    parser.add_argument('--queue-time', type=float, default=2, help='seconds a launched scan stays Queued')
+    parser.add_argument('--scan-time', type=float, default=10, help='seconds a launched scan stays Running')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every API call')
+    parser.add_argument('--jitter', type=float, default=0.2, help='standard deviation of --latency, as a fraction')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of calls answered 429/502/503')
+    parser.add_argument('--verbose', action='store_true')
+    return parser
+
+
+def make_server(opts):
+    ''' HTTP(S) server of a FakeSC seeded from opts, not started yet '''
+    handler = type('FakeSCHandler', (Handler,), dict(sc=FakeSC(opts)))
+    server = ThreadingHTTPServer((opts.host, opts.port), handler)
+    if not opts.plain_http:
+        cert, key = opts.cert, opts.key
+        if not cert:
+            cert, key = self_signed_cert(tempfile.mkdtemp(prefix='fake_sc-'))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def main():
+    opts = argument_parser().parse_args()
+    started = time.time()
+    server = make_server(opts)
+    print('Fake Nessus.sc on %s://%s:%d (seeded in %.1fs)' % (
+        'http' if opts.plain_http else 'https', opts.host, server.server_address[1], time.time() - started))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
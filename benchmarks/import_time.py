@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Startup cost of the nessus-* modules: for every module, in a fresh
+# interpreter, the time to import it (its module level code and the
+# module_utils it pulls in), the time of a whole check mode run and the
+# heavy third party packages loaded by each. No Nessus.sc is contacted.
+#
+#   python3 benchmarks/import_time.py
+#   python3 benchmarks/import_time.py --repeat 10 --json startup.json
+#
+# `python -X importtime benchmarks/run_module.py <module> <args.json>`
+# gives the per package breakdown of a single run.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MODULES = ['nessus-create-assets.py', 'nessus-create-scan.py', 'nessus-launch-scan.py', 'nessus-fetch-scan.py',
+           'nessus-sc-pipeline.py']
+HEAVY = ['tenable', 'requests', 'urllib3', 'pandas', 'concurrent.futures', 'xml.etree.ElementTree']
+
+# required options of every module, enough to pass the argument checks
+CHECK_ARGS = {
+    'nessus-create-assets.py': dict(asset_name='startup', asset_type='ip', file_location='startup.csv'),
+    'nessus-create-scan.py': dict(scan_name='startup'),
+    'nessus-launch-scan.py': dict(scan_name='startup'),
+    'nessus-fetch-scan.py': dict(scan_name='startup'),
+    'nessus-sc-pipeline.py': dict(scan_name='startup'),
+    }
+
+# run in the child interpreter: import the module without running it,
+# print the import time and the heavy packages it loaded
+IMPORT_CHILD = '''
+import json, runpy, sys, time
+started = time.time()
+import ansible.module_utils
+ansible.module_utils.__path__.append(sys.argv[2])
+runpy.run_path(sys.argv[1], run_name='import_time')
+print(json.dumps(dict(time=time.time() - started, loaded=[m for m in sys.argv[3:] if m in sys.modules])))
+'''
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every measure')
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=MODULES)
+    parser.add_argument('--python', default=sys.executable, help='interpreter running the modules')
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser
+
+
+def timed(cmd, cwd=None):
+    ''' Wall time and stdout of cmd '''
+    started = time.time()
+    output = subprocess.check_output(cmd, cwd=cwd)
+    return time.time() - started, output
+
+
+def measure_import(python, module):
+    _, output = timed([python, '-c', IMPORT_CHILD, os.path.join(ROOT, module), os.path.join(ROOT, 'module_utils')]
+                      + HEAVY)
+    return json.loads(output.decode('utf-8'))
+
+
+def measure_check_mode(python, module, workdir):
+    args = dict(CHECK_ARGS[module], server='127.0.0.1', nessus_username='startup', nessus_password='startup',
+                _ansible_check_mode=True)
+    args_path = os.path.join(workdir, 'args.json')
+    with open(args_path, 'w') as f:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=args), f)
+    wall, output = timed([python, os.path.join(HERE, 'run_module.py'), module, args_path], cwd=workdir)
+    result = json.loads(output.decode('utf-8'))
+    if result.get('failed'):
+        raise RuntimeError(module + ' check mode run failed: ' + str(result.get('msg')))
+    return wall
+
+
+def main():
+    opts = argument_parser().parse_args()
+    workdir = tempfile.mkdtemp(prefix='nessus-startup-')
+
+    baseline = statistics.median(timed([opts.python, '-c', 'pass'])[0] for _ in range(opts.repeat))
+    results = dict(python_startup=baseline, modules={})
+    for module in opts.modules:
+        imports = [measure_import(opts.python, module) for _ in range(opts.repeat)]
+        check_runs = [measure_check_mode(opts.python, module, workdir) for _ in range(opts.repeat)]
+        results['modules'][module] = dict(
+            import_time=statistics.median(run['time'] for run in imports),
+            check_mode_time=statistics.median(check_runs),
+            loaded=imports[-1]['loaded']
+            )
+
+    print('python startup: %.0fms' % (baseline * 1000))
+    print('%-24s %10s %12s  %s' % ('module', 'import', 'check mode', 'heavy packages loaded'))
+    for module, r in results['modules'].items():
+        print('%-24s %8.0fms %10.0fms  %s' % (module, r['import_time'] * 1000, r['check_mode_time'] * 1000,
+                                             ', '.join(r['loaded']) or '-'))
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Run a nessus-* module the way Ansible does, without a playbook:
+#
+#   python3 benchmarks/run_module.py nessus-fetch-scan.py args.json
+#
+# args.json holds {"ANSIBLE_MODULE_ARGS": {...}}. The repository
+# module_utils folder is added to the ansible.module_utils package so the
+# `from ansible.module_utils.nessus_sc import ...` lines of the module
+# resolve to the working tree. The module prints its JSON result on stdout.
+
+import os
+import runpy
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def inject_module_utils(folder=os.path.join(ROOT, 'module_utils')):
+    ''' Make ansible.module_utils.<name> import folder/<name>.py '''
+    import ansible.module_utils
+    if folder not in ansible.module_utils.__path__:
+        ansible.module_utils.__path__.append(folder)
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit('usage: run_module.py <module.py> <args.json>')
+    module_path = os.path.join(ROOT, sys.argv[1]) if not os.path.isabs(sys.argv[1]) else sys.argv[1]
+
+    inject_module_utils()
+    # AnsibleModule reads its arguments from the file named by argv[1]
+    sys.argv = [module_path, sys.argv[2]]
+    runpy.run_path(module_path, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
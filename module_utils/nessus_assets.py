@@ -0,0 +1,407 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Helpers building Nessus.sc asset lists from CSV exports (CMDB dumps).
+
+import csv
+import io
+import ipaddress
+import re
+import socket
+import struct
+from collections import OrderedDict
+
+from ansible.module_utils.nessus_sc import call_with_retries, is_not_found, run_concurrently
+
+
+CSV_ENGINES = ['stream', 'pandas']
+# asset_type option -> CSV column
+ASSET_COLUMNS = dict(dns='hostname', ip='ip')
+
+
+class AssetError(Exception):
+    pass
+
+
+def read_csv_column(file_location, column, targets='.*'):
+    ''' Values of column matching the targets regex, reading the CSV file one row at a time
+
+    Only the matching values are kept in memory, whatever the size of the
+    file. Empty cells are skipped.
+    '''
+    pattern = re.compile(targets)
+
+    with io.open(file_location, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None or column not in header:
+            raise AssetError('Column ' + column + ' not found in CSV file ' + file_location)
+        pos = header.index(column)
+
+        values = []
+        for row in reader:
+            if len(row) <= pos:
+                continue
+            value = row[pos].strip()
+            if value and pattern.search(value):
+                values.append(value)
+        return values
+
+
+def read_csv_groups(file_location, column, group_by, targets='.*'):
+    ''' Values of column matching targets bucketed by the value of the group_by column
+
+    The CSV file is read once, row by row. Returns {group: [values]} in
+    the order the groups first appear; rows with an empty group are skipped.
+    '''
+    pattern = re.compile(targets)
+
+    with io.open(file_location, 'r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        for name in (column, group_by):
+            if header is None or name not in header:
+                raise AssetError('Column ' + name + ' not found in CSV file ' + file_location)
+        pos = header.index(column)
+        group_pos = header.index(group_by)
+        last = max(pos, group_pos)
+
+        groups = OrderedDict()
+        for row in reader:
+            if len(row) <= last:
+                continue
+            value = row[pos].strip()
+            group = row[group_pos].strip()
+            if group and value and pattern.search(value):
+                groups.setdefault(group, []).append(value)
+        return groups
+
+
+def read_csv_column_pandas(file_location, column, targets='.*'):
+    ''' Same as read_csv_column() loading the whole file with pandas '''
+    import pandas as pd
+
+    df = pd.read_csv(file_location, usecols=[column], dtype=str, low_memory=False)
+    values = df[column].dropna()
+    return list(values[values.str.contains(pat=targets)])
+
+
+# asset_type column -> (SC list type, details field, pyTenable keyword)
+ASSET_LIST_TYPES = dict(
+    hostname=('dnsname', 'definedDNSNames', 'dns_names'),
+    ip=('static', 'definedIPs', 'ips')
+    )
+UPDATE_MODES = ['delta', 'recreate']
+CHUNK_MODES = ['combine', 'shard']
+
+
+def unique(values):
+    ''' values without duplicates, keeping their first position '''
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+IP_ADDRESS_TYPES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+
+
+def to_text(value):
+    return value if isinstance(value, type(u'')) else value.decode('utf-8')
+
+
+def parse_ip_entry(value):
+    ''' (version, first, last) integer range of an address, CIDR or a-b range entry
+
+    Raises ValueError when the entry is not a valid IPv4 or IPv6 value.
+    '''
+    value = to_text(value).strip()
+    if '-' in value:
+        first, last = value.split('-', 1)
+        first = ipaddress.ip_address(first.strip())
+        last = ipaddress.ip_address(last.strip())
+        if first.version != last.version or first > last:
+            raise ValueError('Invalid ip range ' + value)
+        return first.version, int(first), int(last)
+    if '/' in value:
+        network = ipaddress.ip_network(value, strict=False)
+        return network.version, int(network.network_address), int(network.broadcast_address)
+    try:
+        # plain IPv4 addresses are by far the most common entry, skip the ipaddress objects for them
+        number = struct.unpack('!I', socket.inet_pton(socket.AF_INET, value))[0]
+        return 4, number, number
+    except (socket.error, UnicodeError):
+        pass
+    address = ipaddress.ip_address(value)
+    return address.version, int(address), int(address)
+
+
+def format_ip_range(version, first, last):
+    ''' Smallest list of address/CIDR strings covering first..last '''
+    address = IP_ADDRESS_TYPES[version]
+    if first == last:
+        return [str(address(first))]
+    networks = ipaddress.summarize_address_range(address(first), address(last))
+    return [str(n.network_address) if n.num_addresses == 1 else str(n) for n in networks]
+
+
+def merge_ip_ranges(ranges):
+    ''' Merge overlapping and adjacent (version, first, last) ranges, IPv4 first '''
+    merged = []
+    for version, first, last in sorted(ranges):
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            if last > merged[-1][2]:
+                merged[-1][2] = last
+        else:
+            merged.append([version, first, last])
+    return merged
+
+
+def normalize_ips(values, collapse=True):
+    ''' Parse ip entries, dropping duplicates and invalid ones
+
+    With collapse, contiguous addresses and networks are merged into the
+    smallest list of CIDR ranges. Returns the entries and the invalid values.
+    '''
+    ranges = []
+    invalid = []
+    for value in values:
+        try:
+            ranges.append(parse_ip_entry(value))
+        except ValueError:
+            invalid.append(value)
+
+    if collapse:
+        ranges = merge_ip_ranges(ranges)
+
+    entries = []
+    for version, first, last in ranges:
+        entries.extend(format_ip_range(version, first, last))
+    return unique(entries), invalid
+
+
+def load_hosts(file_location, column, targets='.*', csv_engine='stream', aggregate_ips=True, group_by=None):
+    ''' Hosts of the CSV file column matching targets, ip entries normalized (normalize_ips)
+
+    With group_by, hosts are {group: [hosts]} (read_csv_groups). Returns the
+    hosts and the invalid ip values dropped. Raises ImportError when
+    csv_engine is pandas and pandas is not installed.
+    '''
+    if group_by:
+        hosts = read_csv_groups(file_location, column, group_by, targets)
+    elif csv_engine == 'pandas':
+        hosts = read_csv_column_pandas(file_location, column, targets)
+    else:
+        hosts = read_csv_column(file_location, column, targets)
+
+    invalid = []
+    if column == 'ip':
+        if group_by:
+            for group in hosts:
+                hosts[group], dropped = normalize_ips(hosts[group], aggregate_ips)
+                invalid.extend(dropped)
+        else:
+            hosts, invalid = normalize_ips(hosts, aggregate_ips)
+    return hosts, invalid
+
+
+def member_keys(column, values):
+    ''' Comparable form of asset list members: lowercase hostnames, collapsed ip ranges '''
+    if column == 'ip':
+        return set(normalize_ips(values)[0])
+    return set(v.lower() for v in values)
+
+
+def asset_list_members(sc, asset_id, column):
+    ''' Current hostnames or ips of the asset list asset_id, or None if its type is not column's '''
+    list_type, field, _ = ASSET_LIST_TYPES[column]
+    details = sc.asset_lists.details(asset_id, fields=['id', 'type', field])
+    if details.get('type') != list_type:
+        return None
+    return [v for v in re.split(r'[,\s]+', details.get(field) or '') if v]
+
+
+def sync_asset_list(sc, index, asset_name, column, members, update_mode='delta'):
+    ''' Make the asset list asset_name hold exactly members (hostnames or ips)
+
+    In delta mode an existing list is only edited when its members differ,
+    keeping its ID so the scans using it keep working. recreate deletes and
+    creates the list again. Returns changed, asset_id and the number of
+    members added and removed.
+    '''
+    members = unique(members)
+    return index.with_id('asset_lists', asset_name, lambda asset_id: sync_asset_list_id(
+        sc, index, asset_name, asset_id, column, members, update_mode))
+
+
+def sync_asset_list_id(sc, index, asset_name, asset_id, column, members, update_mode='delta'):
+    ''' sync_asset_list() of the existing asset list asset_id, None to create it '''
+    list_type, _, keyword = ASSET_LIST_TYPES[column]
+
+    if asset_id is not None and update_mode == 'delta':
+        current = asset_list_members(sc, asset_id, column)
+        if current is not None:
+            current_keys = member_keys(column, current)
+            new_keys = member_keys(column, members)
+            added = len(new_keys - current_keys)
+            removed = len(current_keys - new_keys)
+            if added or removed:
+                try:
+                    sc.asset_lists.edit(asset_id, **{keyword: members})
+                except Exception as e:
+                    raise AssetError('Error updating Nessus asset list [' + asset_name + ']: ' + str(e))
+            return dict(changed=bool(added or removed), asset_id=asset_id, added=added, removed=removed)
+
+    # overwrite existing asset list
+    if asset_id is not None:
+        sc.asset_lists.delete(asset_id)
+        index.deleted('asset_lists', asset_id)
+
+    try:
+        created = sc.asset_lists.create(asset_name, list_type=list_type, **{keyword: members})
+    except Exception as e:
+        raise AssetError('Error creating Nessus asset list [' + asset_name + ']: ' + str(e))
+    index.created('asset_lists', asset_name, created['id'])
+
+    return dict(changed=True, asset_id=int(created['id']), added=len(members), removed=0)
+
+
+def shard_name(asset_name, number):
+    return asset_name + '-' + '%03d' % number
+
+
+def shard_pattern(asset_name):
+    ''' Regex matching the shard names of asset_name, the shard number as group 1 '''
+    return re.compile('^' + re.escape(asset_name) + r'-(\d{3,})$')
+
+
+def has_shards(index, asset_name):
+    ''' True if asset_name was already split into shards by sync_chunked_asset_list() '''
+    pattern = shard_pattern(asset_name)
+    return any(pattern.match(name) for name in index.names('asset_lists'))
+
+
+def combination(ids):
+    ''' pyTenable combination expression OR-ing the asset list ids, as a balanced tree '''
+    if len(ids) == 1:
+        # the expression has to be an operation, a single list is OR-ed with itself
+        return ('or', ids[0], ids[0])
+    return combination_tree(ids)
+
+
+def combination_tree(ids):
+    if len(ids) == 1:
+        return ids[0]
+    middle = len(ids) // 2
+    return ('or', combination_tree(ids[:middle]), combination_tree(ids[middle:]))
+
+
+def sync_combination_list(sc, index, asset_name, ids, shards_changed):
+    ''' Make asset_name a combination asset list OR-ing the asset lists ids '''
+    return index.with_id('asset_lists', asset_name, lambda asset_id: sync_combination_list_id(
+        sc, index, asset_name, asset_id, ids, shards_changed))
+
+
+def sync_combination_list_id(sc, index, asset_name, asset_id, ids, shards_changed):
+    if asset_id is not None:
+        details = sc.asset_lists.details(asset_id, fields=['id', 'type'])
+        if details.get('type') == 'combination':
+            if shards_changed:
+                sc.asset_lists.edit(asset_id, combinations=combination(ids))
+            return asset_id, shards_changed
+        sc.asset_lists.delete(asset_id)
+        index.deleted('asset_lists', asset_id)
+
+    created = sc.asset_lists.create(asset_name, list_type='combination', combinations=combination(ids))
+    index.created('asset_lists', asset_name, created['id'])
+    return int(created['id']), True
+
+
+def sync_chunked_asset_list(sc, index, asset_name, column, members, update_mode='delta',
+                            chunk_size=10000, chunk_mode='combine', retries=3, workers=1, log=None):
+    ''' Split members over asset lists asset_name-001..N of at most chunk_size entries
+
+    Every shard is synced (sync_asset_list) on its own request and retried
+    up to retries times, shards left over from a previous, longer run are
+    deleted. With chunk_mode combine, asset_name is a combination asset
+    list OR-ing all the shards, so scans keep using a single asset list.
+    log(message) is called as every shard completes.
+    '''
+    members = sorted(unique(members))
+    chunks = [members[i:i + chunk_size] for i in range(0, len(members), chunk_size)] or [[]]
+    total = len(chunks)
+    names = [shard_name(asset_name, n + 1) for n in range(total)]
+
+    # listed once before the workers share it
+    existing = dict((name, list(ids)) for name, ids in index.names('asset_lists').items())
+
+    def sync(job):
+        name, chunk = job
+        shard, attempts = call_with_retries(
+            lambda: sync_asset_list(sc, index, name, column, chunk, update_mode), retries)
+        shard.update(name=name, count=len(chunk), attempts=attempts)
+        if log:
+            log('Nessus.sc asset list [' + name + '] synced (' + str(len(chunk)) + ' entries, '
+                + str(attempts) + ' attempts)')
+        return shard
+
+    shards = []
+    failed = []
+    for (name, chunk), shard, error in run_concurrently(sync, list(zip(names, chunks)), workers):
+        if error:
+            failed.append(name)
+            shards.append(dict(name=name, count=len(chunk), error=error))
+        else:
+            shards.append(shard)
+    if failed:
+        raise AssetError('Error syncing Nessus asset list chunks [' + ', '.join(failed) + ']: '
+                         + '; '.join(shard['error'] for shard in shards if 'error' in shard))
+
+    # drop the shards a previous, bigger list needed
+    stale = shard_pattern(asset_name)
+    removed_shards = 0
+    for name in sorted(existing):
+        match = stale.match(name)
+        if match and int(match.group(1)) > total:
+            for asset_id in index.ids('asset_lists', name):
+                try:
+                    sc.asset_lists.delete(asset_id)
+                    removed_shards += 1
+                except Exception as e:
+                    # already deleted, only the cached listing had it
+                    if not is_not_found(e):
+                        raise
+                index.deleted('asset_lists', asset_id)
+
+    # the combination only needs editing when the set of shard IDs moved
+    shards_changed = removed_shards > 0 or any(existing.get(shard['name'], [None])[0] != shard['asset_id']
+                                                 for shard in shards)
+    result = dict(
+        changed=removed_shards > 0 or any(shard['changed'] for shard in shards),
+        asset_id=None,
+        added=sum(shard['added'] for shard in shards),
+        removed=sum(shard['removed'] for shard in shards),
+        chunks=shards
+        )
+
+    if chunk_mode == 'combine':
+        try:
+            result['asset_id'], combo_changed = sync_combination_list(
+                sc, index, asset_name, [shard['asset_id'] for shard in shards], shards_changed)
+        except Exception as e:
+            raise AssetError('Error creating Nessus combination asset list [' + asset_name + ']: ' + str(e))
+        result['changed'] = result['changed'] or combo_changed
+
+    return result
+
+
+def build_asset_list(sc, index, asset_name, column, members, update_mode='delta',
+                     chunk_size=0, chunk_mode='combine', retries=3, workers=1, log=None):
+    ''' sync_asset_list(), or sync_chunked_asset_list() when members go over chunk_size
+
+    A list already split into shards stays chunked (down to a single shard)
+    once it fits in chunk_size again, so the combination list scans use
+    keeps its ID and the shards no longer needed are deleted.
+    '''
+    if chunk_size and (len(members) > chunk_size or has_shards(index, asset_name)):
+        return sync_chunked_asset_list(sc, index, asset_name, column, members, update_mode,
+                                       chunk_size, chunk_mode, retries, workers, log)
+    return sync_asset_list(sc, index, asset_name, column, members, update_mode)
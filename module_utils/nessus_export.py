@@ -0,0 +1,356 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Streaming download of Nessus.sc scan result exports. The export is a zip
+# archive holding a single <scan result id>.nessus file; it is decompressed
+# while the HTTP body arrives so nothing but the final report touches disk.
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+_ZIP64_EXTRA = 0x0001
+_FLAG_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_UTF8_BOM = b'\xef\xbb\xbf'
+# leading whitespace accepted before the first < of a plain XML export
+_MAX_XML_PREAMBLE = 4096
+
+
+class ExportError(Exception):
+    pass
+
+
+class AtomicWriter(object):
+    ''' File written under a temporary name and renamed to path once complete '''
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        self.tmp_path = os.path.join(folder, '.' + os.path.basename(path) + '.' + str(os.getpid()) + '.part')
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.tmp_path, 'wb')
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.rename(self.tmp_path, self.path)
+        else:
+            self._file.close()
+            os.remove(self.tmp_path)
+        return False
+
+
+class HashingWriter(object):
+    ''' File-like wrapper computing the sha256 of everything written through it '''
+
+    def __init__(self, out):
+        self.out = out
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.out.write(data)
+
+
+class ZipMemberWriter(object):
+    ''' Extract the first member ending with suffix from zip data fed chunk by chunk
+
+    Only the local file headers are used, so the member is written out as
+    soon as its bytes arrive instead of waiting for the central directory
+    at the end of the archive. Payloads that are not a zip archive are
+    copied unchanged when they are XML (a < after an optional BOM and
+    whitespace); anything else, such as an error answered with status 200,
+    raises ExportError.
+    '''
+
+    def __init__(self, out, suffix='.nessus'):
+        self.out = out
+        self.suffix = suffix
+        self.member = None
+        self.size = 0
+        self._buf = b''
+        self._state = 'start'
+        self._entry = None
+
+    def feed(self, data):
+        self._buf += data
+        while self._step():
+            pass
+
+    def close(self):
+        if self._state not in ('raw', 'header', 'done') or self._buf and self._state == 'header':
+            raise ExportError('Scan export ended before the end of the zip archive')
+        if self._state != 'raw' and self.member is None:
+            raise ExportError('No ' + self.suffix + ' file found in the scan export')
+
+    def _emit(self, data):
+        if data and self._entry['wanted']:
+            self.out.write(data)
+            self._entry['crc'] = zlib.crc32(data, self._entry['crc'])
+            self.size += len(data)
+
+    def _step(self):
+        state = self._state
+
+        if state == 'start':
+            if len(self._buf) < len(_LOCAL_SIGNATURE):
+                return False
+            if self._buf.startswith(_LOCAL_SIGNATURE):
+                self._state = 'header'
+                return True
+            head = self._buf[len(_UTF8_BOM):] if self._buf.startswith(_UTF8_BOM) else self._buf
+            head = head.lstrip()
+            if not head and len(self._buf) <= _MAX_XML_PREAMBLE:
+                return False
+            if not head.startswith(b'<'):
+                raise ExportError('Scan export is neither a zip archive nor a .nessus XML report: '
+                                  + self._buf[:200].decode('utf-8', 'replace'))
+            self._state = 'raw'
+            return True
+
+        if state == 'raw':
+            self.out.write(self._buf)
+            self.size += len(self._buf)
+            self._buf = b''
+            return False
+
+        if state == 'done':
+            self._buf = b''
+            return False
+
+        if state == 'header':
+            return self._read_header()
+
+        if state == 'data':
+            return self._read_data()
+
+        if state == 'descriptor':
+            return self._read_descriptor()
+
+        return False
+
+    def _read_header(self):
+        if len(self._buf) < 4:
+            return False
+        if not self._buf.startswith(_LOCAL_SIGNATURE):
+            # central directory reached, every member has been seen
+            self._state = 'done'
+            return True
+        if len(self._buf) < _LOCAL_HEADER.size:
+            return False
+
+        (_, _, flags, method, _, _, crc, csize, _, name_len, extra_len) = _LOCAL_HEADER.unpack_from(self._buf)
+        end = _LOCAL_HEADER.size + name_len + extra_len
+        if len(self._buf) < end:
+            return False
+
+        raw_name = self._buf[_LOCAL_HEADER.size:_LOCAL_HEADER.size + name_len]
+        name = raw_name.decode('utf-8' if flags & _FLAG_UTF8 else 'cp437')
+        extra = self._buf[_LOCAL_HEADER.size + name_len:end]
+        self._buf = self._buf[end:]
+
+        zip64 = False
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack_from('<HH', extra, pos)
+            if tag == _ZIP64_EXTRA:
+                zip64 = True
+                if csize == 0xFFFFFFFF and size >= 16:
+                    csize = struct.unpack_from('<Q', extra, pos + 12)[0]
+            pos += 4 + size
+
+        if method == 8:
+            inflate = zlib.decompressobj(-15)
+        elif method == 0 and not flags & _FLAG_DESCRIPTOR:
+            inflate = None
+        else:
+            raise ExportError('Unsupported zip entry in scan export: ' + name)
+
+        self._entry = dict(
+            name=name,
+            wanted=self.member is None and name.endswith(self.suffix),
+            flags=flags,
+            zip64=zip64,
+            expected_crc=crc,
+            crc=0,
+            remaining=csize,
+            inflate=inflate
+            )
+        self._state = 'data'
+        return True
+
+    def _read_data(self):
+        entry = self._entry
+
+        if entry['inflate'] is None:
+            chunk = self._buf[:entry['remaining']]
+            self._buf = self._buf[len(chunk):]
+            entry['remaining'] -= len(chunk)
+            self._emit(chunk)
+            if entry['remaining']:
+                return False
+        else:
+            if not self._buf:
+                return False
+            inflate = entry['inflate']
+            self._emit(inflate.decompress(self._buf))
+            self._buf = b''
+            if not inflate.eof:
+                return False
+            self._buf = inflate.unused_data
+
+        if entry['flags'] & _FLAG_DESCRIPTOR:
+            self._state = 'descriptor'
+        else:
+            self._finish_entry(entry['expected_crc'])
+        return True
+
+    def _read_descriptor(self):
+        if len(self._buf) < 4:
+            return False
+        offset = 4 if self._buf.startswith(_DESCRIPTOR_SIGNATURE) else 0
+        size = offset + 4 + (16 if self._entry['zip64'] else 8)
+        if len(self._buf) < size:
+            return False
+        crc = struct.unpack_from('<I', self._buf, offset)[0]
+        self._buf = self._buf[size:]
+        self._finish_entry(crc)
+        return True
+
+    def _finish_entry(self, expected_crc):
+        entry = self._entry
+        if entry['wanted']:
+            if entry['crc'] & 0xFFFFFFFF != expected_crc:
+                raise ExportError('CRC mismatch extracting ' + entry['name'] + ' from the scan export')
+            self.member = entry['name']
+        self._entry = None
+        self._state = 'header'
+
+
+def export_scan_to_file(sc, scan_id, dest, chunk_size=EXPORT_CHUNK_SIZE):
+    ''' Stream the export of scan result scan_id into the .nessus file dest
+
+    The file only appears under dest once fully written, so a failed
+    download never leaves a truncated report behind. Returns its size
+    and sha256.
+    '''
+    # same format as pyTenable scan_instances.export_scan()
+    resp = sc.post('scanResult/' + str(int(scan_id)) + '/download', json={'downloadType': 'v2'}, stream=True)
+    try:
+        with AtomicWriter(dest) as out:
+            hashed = HashingWriter(out)
+            extractor = ZipMemberWriter(hashed)
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    extractor.feed(chunk)
+            extractor.close()
+    finally:
+        resp.close()
+    return dict(size=extractor.size, sha256=hashed.sha256.hexdigest())
+
+
+def manifest_path(dest):
+    return dest + '.manifest'
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    with AtomicWriter(path) as f:
+        f.write(json.dumps(data, sort_keys=True).encode('utf-8'))
+
+
+def read_manifest(dest):
+    return read_json(manifest_path(dest))
+
+
+def write_manifest(dest, manifest):
+    write_json(manifest_path(dest), manifest)
+
+
+def launch_record_path(dest):
+    return dest + '.launch'
+
+
+def read_launch_record(dest):
+    ''' scan_name, instance_id and launched time of the scan result launched for dest and not fetched yet '''
+    return read_json(launch_record_path(dest))
+
+
+def write_launch_record(dest, record):
+    write_json(launch_record_path(dest), record)
+
+
+def clear_launch_record(dest):
+    try:
+        os.remove(launch_record_path(dest))
+    except OSError:
+        pass
+
+
+def report_is_current(dest, manifest, scan_id, finish_time):
+    ''' True if dest is still the untouched export of scan result scan_id finished at finish_time '''
+    if not manifest or manifest.get('scan_id') != scan_id or manifest.get('finish_time') != finish_time:
+        return False
+    try:
+        st = os.stat(dest)
+    except OSError:
+        return False
+    return st.st_size == manifest.get('size') and int(st.st_mtime) == manifest.get('mtime')
+
+
+def fetch_scan_report(sc, scan_id, dest, incremental=True):
+    ''' Download the scan result scan_id to dest once it is COMPLETED
+
+    With incremental, a manifest kept next to dest records the scan result
+    ID, finish time and sha256 of the report, and the download is skipped
+    (changed False) when dest already holds that same scan result.
+    '''
+    scan_id = int(scan_id)
+
+    # check scan is COMPLETED and not in PARTIAL or RUNNING state
+    details = sc.scan_instances.details(scan_id, fields=['id', 'status', 'finishTime'])
+    scan_status = details['status']
+    if scan_status.lower() != 'completed':
+        raise ExportError('Nesuss scan has not been COMPLETED. Scan status: ' + str(scan_status))
+    finish_time = str(details.get('finishTime'))
+
+    report = dict(output=dest, scan_id=scan_id, finish_time=finish_time)
+
+    manifest = read_manifest(dest) if incremental else None
+    if report_is_current(dest, manifest, scan_id, finish_time):
+        report.update(changed=False, size=manifest['size'], sha256=manifest['sha256'])
+        return report
+
+    report.update(export_scan_to_file(sc, scan_id, dest))
+    report['changed'] = True
+
+    if incremental:
+        write_manifest(dest, dict(
+            scan_id=scan_id,
+            finish_time=finish_time,
+            size=report['size'],
+            sha256=report['sha256'],
+            mtime=int(os.stat(dest).st_mtime)
+            ))
+    return report
@@ -0,0 +1,125 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Incremental .nessus (NessusClientData_v2) parsing. Reports are read with
+# iterparse and every host is dropped from the tree once processed, so the
+# memory used does not grow with the size of the report.
+
+import csv
+import io
+import json
+import os
+
+from ansible.module_utils.nessus_export import AtomicWriter, fetch_scan_report
+
+
+FINDINGS_FORMATS = ['jsonl', 'csv']
+FINDING_FIELDS = ['host', 'host_ip', 'plugin_id', 'plugin_name', 'severity', 'port', 'protocol', 'svc_name', 'cves']
+
+
+def iter_findings(path):
+    ''' Yield one dict per ReportItem of the .nessus file path '''
+    from xml.etree.ElementTree import iterparse
+
+    report = None
+    host = None
+    host_name = None
+    host_ip = None
+
+    for event, elem in iterparse(path, events=('start', 'end')):
+        tag = elem.tag
+
+        if event == 'start':
+            if tag == 'Report':
+                report = elem
+            elif tag == 'ReportHost':
+                host = elem
+                host_name = elem.get('name')
+                host_ip = None
+            continue
+
+        if tag == 'tag' and elem.get('name') == 'host-ip' and host is not None:
+            host_ip = elem.text
+
+        elif tag == 'ReportItem' and host is not None:
+            yield dict(
+                host=host_name,
+                host_ip=host_ip or host_name,
+                plugin_id=int(elem.get('pluginID', 0)),
+                plugin_name=elem.get('pluginName'),
+                severity=int(elem.get('severity', 0)),
+                port=int(elem.get('port', 0)),
+                protocol=elem.get('protocol'),
+                svc_name=elem.get('svc_name'),
+                cves=[cve.text for cve in elem.findall('cve') if cve.text]
+                )
+            # items are appended to the host as they are parsed, drop the ones already seen
+            del host[:]
+
+        elif tag == 'ReportHost':
+            elem.clear()
+            if report is not None:
+                del report[:]
+            host = None
+
+
+def findings_path(report, findings_format):
+    base = report[:-len('.nessus')] if report.endswith('.nessus') else report
+    return base + '.' + findings_format
+
+
+def write_findings(report, findings_format, dest=None):
+    ''' Write the findings of the .nessus file report as JSON lines or CSV
+
+    Returns the destination path and the number of findings written.
+    '''
+    dest = dest or findings_path(report, findings_format)
+    count = 0
+
+    with AtomicWriter(dest) as raw:
+        out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        if findings_format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=FINDING_FIELDS)
+            writer.writeheader()
+            for finding in iter_findings(report):
+                finding['cves'] = ';'.join(finding['cves'])
+                writer.writerow(finding)
+                count += 1
+        else:
+            for finding in iter_findings(report):
+                out.write(json.dumps(finding, sort_keys=True) + '\n')
+                count += 1
+        out.flush()
+        out.detach()
+
+    return dest, count
+
+
+def update_findings(report, findings_format, changed=True):
+    ''' write_findings() unless the report did not change and its findings file is already there '''
+    dest = findings_path(report, findings_format)
+    if not changed and os.path.exists(dest):
+        return dict(findings=dest, changed=False)
+    dest, count = write_findings(report, findings_format, dest)
+    return dict(findings=dest, findings_count=count, changed=True)
+
+
+def fetch_report(sc, scan_id, scan_name, dest=None, incremental=True, findings_format=None, findings_db=None,
+                 delta_limit=0):
+    ''' fetch_scan_report() to dest (scan_name.nessus), then its findings file and findings_db when asked
+
+    changed is true when the report, the findings file or the findings
+    database changed.
+    '''
+    report = fetch_scan_report(sc, scan_id, dest or scan_name + '.nessus', incremental)
+    if findings_format:
+        findings = update_findings(report['output'], findings_format, report['changed'])
+        report['changed'] = findings.pop('changed') or report['changed']
+        report.update(findings)
+    if findings_db:
+        # sqlite3 is only loaded when a findings database is used
+        from ansible.module_utils.nessus_store import store_findings
+        stored = store_findings(findings_db, report, scan_name, delta_limit)
+        report['changed'] = stored.pop('changed') or report['changed']
+        report.update(stored)
+    return report
@@ -0,0 +1,70 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# HTTP transport of the TenableSC clients: a keep-alive connection pool
+# retrying transient failures (429 and 5xx answers, dropped connections)
+# with jittered exponential backoff, honouring Retry-After.
+
+import random
+import re
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# calls that can be sent twice without side effects; other POSTs (create,
+# launch) are only retried when SC did not process them: connection failed
+# before they were sent or 429 Too Many Requests
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'PATCH'])
+READ_ONLY_POSTS = re.compile(r'/(token|scanResult/\d+/download)/?(\?|$)')
+
+
+class JitteredRetry(Retry):
+    ''' Retry sleeping a random time between half and all of the exponential backoff
+
+    Spreads the retries of concurrent workers hitting the same 429/503.
+    Retry-After, when sent, still takes precedence.
+    '''
+
+    def increment(self, method=None, url=None, *args, **kwargs):
+        response = kwargs.get('response')
+        if (method and method.upper() not in IDEMPOTENT_METHODS and not READ_ONLY_POSTS.search(url or '')
+                and not (response is not None and response.status == 429)):
+            # read errors and error answers end the retries, connection errors are retried
+            retry = self.new(read=False, status=0)
+            return super(JitteredRetry, retry).increment(method, url, *args, **kwargs)
+        return super(JitteredRetry, self).increment(method, url, *args, **kwargs)
+
+    def get_backoff_time(self):
+        backoff = super(JitteredRetry, self).get_backoff_time()
+        return random.uniform(backoff / 2.0, backoff)
+
+
+def make_retry(retries, backoff):
+    options = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                   status_forcelist=RETRY_STATUS, raise_on_status=False, respect_retry_after_header=True)
+    try:
+        return JitteredRetry(allowed_methods=IDEMPOTENT_METHODS | set(['POST']), **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return JitteredRetry(method_whitelist=IDEMPOTENT_METHODS | set(['POST']), **options)
+
+
+class PooledAdapter(HTTPAdapter):
+    ''' HTTPAdapter keeping up to pool_size connections alive and counting the retries made '''
+
+    def __init__(self, pool_size=10, retries=5, backoff=1.0):
+        self.retry_count = 0
+        self._lock = threading.Lock()
+        super(PooledAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_size,
+                                            max_retries=make_retry(retries, backoff))
+
+    def send(self, request, **kwargs):
+        resp = super(PooledAdapter, self).send(request, **kwargs)
+        history = getattr(getattr(resp.raw, 'retries', None), 'history', None)
+        if history:
+            with self._lock:
+                self.retry_count += len(history)
+        return resp
@@ -0,0 +1,178 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Per endpoint timing and counters of the Nessus.sc API calls made by a
+# module run. The TenableSC session is wrapped, so every call (login,
+# lists, creates, launches, downloads) is accounted without touching the
+# code making it.
+
+import json
+import re
+import threading
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+# metrics of the running module, told about every sleep()
+_active = []
+
+
+def sleep(seconds):
+    ''' time.sleep() accounted as sleep_time in the metrics of the running module '''
+    started = time.time()
+    time.sleep(seconds)
+    for metrics in _active:
+        metrics.record_sleep(time.time() - started)
+
+
+def endpoint_name(method, url):
+    ''' METHOD path of an API url without the /rest prefix, numeric IDs replaced by {id} '''
+    path = urlparse(url).path
+    if '/rest/' in path:
+        path = path.split('/rest/', 1)[1]
+    return method.upper() + ' ' + _ID_SEGMENT.sub('/{id}', '/' + path.strip('/'))[1:]
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if hasattr(body, '__len__'):
+        return len(body)
+    return 0
+
+
+class ApiMetrics(object):
+    ''' Count, latency, bytes and retries of the API calls, per endpoint
+
+    instrument(sc) wraps the requests session of a TenableSC client. With
+    trace_path, every call is also appended to that file as a JSON line.
+    Streamed downloads count their bytes as the body is read; their time
+    is the time to the response headers.
+    '''
+
+    def __init__(self, trace_path=None):
+        self.started = time.time()
+        self.endpoints = {}
+        self.sleep_time = 0.0
+        self.trace_path = trace_path
+        self._trace = None
+        self._lock = threading.Lock()
+        _active.append(self)
+
+    def instrument(self, sc):
+        session = sc._session
+        request = session.request
+
+        def timed_request(method, url, *args, **kwargs):
+            started = time.time()
+            try:
+                resp = request(method, url, *args, **kwargs)
+            except Exception as e:
+                self.record(method, url, time.time() - started, error=e.__class__.__name__)
+                raise
+            retries = getattr(getattr(resp.raw, 'retries', None), 'history', None) or ()
+            stream = kwargs.get('stream')
+            self.record(method, url, time.time() - started, status=resp.status_code,
+                        sent=body_size(resp.request.body),
+                        received=0 if stream else len(resp.content),
+                        retries=len(retries))
+            if stream:
+                self._count_stream(resp, endpoint_name(method, url))
+            return resp
+
+        session.request = timed_request
+        return sc
+
+    def _count_stream(self, resp, key):
+        iter_content = resp.iter_content
+
+        def counted(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                with self._lock:
+                    self.endpoints[key]['bytes_received'] += len(chunk)
+                yield chunk
+
+        resp.iter_content = counted
+
+    def record(self, method, url, elapsed, status=None, sent=0, received=0, retries=0, error=None):
+        key = endpoint_name(method, url)
+        with self._lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = dict(count=0, errors=0, retries=0, time=0.0, max_time=0.0,
+                                                   bytes_sent=0, bytes_received=0)
+            stats['count'] += 1
+            stats['errors'] += 1 if error or (status or 0) >= 400 else 0
+            stats['retries'] += retries
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            stats['bytes_sent'] += sent
+            stats['bytes_received'] += received
+
+            if self.trace_path:
+                if self._trace is None:
+                    self._trace = open(self.trace_path, 'a')
+                self._trace.write(json.dumps(dict(
+                    time=round(time.time(), 3), endpoint=key, status=status, elapsed=round(elapsed, 4),
+                    bytes_sent=sent, bytes_received=received, retries=retries, error=error
+                    ), sort_keys=True) + '\n')
+                self._trace.flush()
+
+    def record_sleep(self, seconds):
+        with self._lock:
+            self.sleep_time += seconds
+
+    def summary(self):
+        ''' Totals and per endpoint stats, times in seconds '''
+        with self._lock:
+            endpoints = {}
+            for key, stats in self.endpoints.items():
+                stats = dict(stats)
+                stats['time'] = round(stats['time'], 3)
+                stats['max_time'] = round(stats['max_time'], 3)
+                endpoints[key] = stats
+            values = list(endpoints.values())
+            return dict(
+                wall_time=round(time.time() - self.started, 3),
+                api_time=round(sum(s['time'] for s in values), 3),
+                sleep_time=round(self.sleep_time, 3),
+                calls=sum(s['count'] for s in values),
+                errors=sum(s['errors'] for s in values),
+                retries=sum(s['retries'] for s in values),
+                bytes_sent=sum(s['bytes_sent'] for s in values),
+                bytes_received=sum(s['bytes_received'] for s in values),
+                endpoints=endpoints
+                )
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+        if self in _active:
+            _active.remove(self)
+
+
+def report_on_exit(module, key, value, close=None):
+    ''' Add key=value() to whatever exit_json()/fail_json() ends the module, then call close() '''
+    def with_value(func):
+        def finish(*args, **kwargs):
+            kwargs[key] = value()
+            if close:
+                close()
+            return func(*args, **kwargs)
+        return finish
+
+    module.exit_json = with_value(module.exit_json)
+    module.fail_json = with_value(module.fail_json)
+
+
+def report_metrics(module, metrics):
+    ''' Add metrics=metrics.summary() to the module result '''
+    report_on_exit(module, 'metrics', metrics.summary, metrics.close)
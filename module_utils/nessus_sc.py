@@ -0,0 +1,507 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Shared helpers for the nessus-* modules. Ansible ships this file to the
+# managed node when a module does `from ansible.module_utils.nessus_sc import ...`
+# (place this folder next to the playbook or point ANSIBLE_MODULE_UTILS to it).
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from ansible.module_utils.nessus_metrics import ApiMetrics, report_metrics, report_on_exit, sleep
+
+
+def has_module(name):
+    ''' True if the top level package name is installed, without importing it '''
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        # Python 2
+        import imp
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
+    return find_spec(name) is not None
+
+
+# pyTenable (and requests) take longer to import than the rest of a module
+# run in check mode, so they are only imported by sc_connect()
+HAS_PYTENABLE = has_module('tenable')
+
+
+DEFAULT_CACHE_DIR = '~/.ansible/nessus_sc'
+DEFAULT_CACHE_TTL = 300
+DEFAULT_WORKERS = 4
+DEFAULT_POOL_SIZE = 10
+
+TIME_UNITS = dict(s=1, m=60, h=3600, d=86400, w=604800)
+MAX_WINDOW = 365 * 86400
+
+# scan result states after which SC will not update the scan result anymore
+TERMINAL_SCAN_STATUS = ['completed', 'partial', 'error', 'canceled', 'cancelled', 'failed']
+
+
+# list calls used to build the name -> ID index of each object type
+INDEX_SOURCES = dict(
+    scans=lambda sc: sc.scans.list(fields=['id', 'name'])['usable'],
+    policies=lambda sc: sc.policies.list(fields=['id', 'name'])['usable'],
+    asset_lists=lambda sc: sc.asset_lists.list(fields=['id', 'name'])['usable'],
+    credentials=lambda sc: sc.credentials.list(fields=['id', 'name'])['usable'],
+    scan_instances=lambda sc: sc.scan_instances.list(start_time=1, fields=['id', 'name'])['usable']
+    )
+# types listed again on every run: a scan launched by a schedule or from
+# the UI would otherwise be missing from latest() for up to cache_ttl
+UNCACHED_KINDS = ['scan_instances']
+
+
+def is_not_found(error):
+    ''' True for an API error telling the object does not exist (SC answers 403 or 404) '''
+    return getattr(getattr(error, 'response', None), 'status_code', None) in (403, 404)
+
+
+def nessus_sc_argument_spec():
+    ''' Connection options shared by every nessus-* module '''
+    return dict(
+        server=dict(type='str', required=True),
+        port=dict(type='int', required=False, default=443),
+        connect_timeout=dict(type='int', required=False, default=10),
+        read_timeout=dict(type='int', required=False, default=300),
+        max_retries=dict(type='int', required=False, default=5),
+        retry_backoff=dict(type='float', required=False, default=1.0),
+        pool_size=dict(type='int', required=False, default=DEFAULT_POOL_SIZE),
+        nessus_username=dict(type='str', required=True),
+        nessus_password=dict(type='str', required=True, no_log=True),
+        session_cache=dict(type='bool', required=False, default=True),
+        cache_dir=dict(type='path', required=False, default=DEFAULT_CACHE_DIR),
+        cache_ttl=dict(type='int', required=False, default=DEFAULT_CACHE_TTL),
+        metrics=dict(type='bool', required=False, default=True),
+        trace_file=dict(type='path', required=False)
+        )
+
+
+def cache_key(server, port, username):
+    ''' Short stable key identifying a server:port/user triple in the cache folder '''
+    raw = (server + '\0' + str(port) + '\0' + username).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def read_private_json(path):
+    ''' Load a cache file, returning None when missing or unreadable '''
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_private_json(path, data):
+    ''' Atomically write a cache file only readable by the current user '''
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, 0o700)
+
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+
+class SessionCache(object):
+    ''' Nessus.sc session token and cookies persisted between module runs '''
+
+    def __init__(self, cache_dir, server, port, username):
+        self.path = os.path.join(os.path.expanduser(cache_dir),
+                                 'session-' + cache_key(server, port, username) + '.json')
+
+    def load(self):
+        state = read_private_json(self.path)
+        if not state or not state.get('token'):
+            return None
+        return state
+
+    def save(self, sc):
+        write_private_json(self.path, dict(
+            token=sc._session.headers.get('X-SecurityCenter'),
+            cookies=sc._session.cookies.get_dict(),
+            created=int(time.time())
+            ))
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def restore_session(sc, state):
+    ''' Re-attach a cached session to sc, returning True if SC still accepts it '''
+    sc._session.headers.update({'X-SecurityCenter': str(state['token'])})
+    for name, value in state.get('cookies', {}).items():
+        sc._session.cookies.set(name, value)
+
+    try:
+        sc.get('currentUser', params={'fields': 'id'})
+        return True
+    except Exception:
+        sc._session.headers.pop('X-SecurityCenter', None)
+        sc._session.cookies.clear()
+        return False
+
+
+def run_concurrently(func, items, workers=DEFAULT_WORKERS):
+    ''' Call func(item) for every item using at most workers threads
+
+    Returns a list of (item, result, error) tuples in the order of items,
+    error being None or the message of the exception func raised.
+    '''
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, str(e) or e.__class__.__name__
+
+    if workers <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(call, items))
+
+
+def call_with_retries(func, retries=3, delay=2):
+    ''' Call func() up to retries + 1 times, doubling delay between attempts
+
+    Returns (result, attempts); the last exception is raised when every
+    attempt failed.
+    '''
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func(), attempt
+        except Exception:
+            if attempt > retries:
+                raise
+            sleep(delay * 2 ** (attempt - 1))
+
+
+def sc_connect(module):
+    ''' Return a logged in TenableSC client, reusing a cached session when possible
+
+    Calls go through a keep-alive pool of pool_size connections with
+    separate connect and read timeouts. Idempotent calls answered 429/5xx
+    or whose connection dropped are retried max_retries times (see
+    PooledAdapter), and the module result reports http_retries. With the
+    metrics option, every API call the client makes from then on is timed
+    and the module result gets a metrics entry (see ApiMetrics).
+    '''
+    from tenable.sc import TenableSC
+    from ansible.module_utils.nessus_http import PooledAdapter
+
+    metrics = None
+    if module.params['metrics'] or module.params['trace_file']:
+        metrics = ApiMetrics(module.params['trace_file'])
+        report_metrics(module, metrics)
+
+    server = module.params['server']
+    nessus_username = module.params['nessus_username']
+    nessus_password = module.params['nessus_password']
+
+    cache = None
+    if module.params['session_cache']:
+        cache = SessionCache(module.params['cache_dir'], server, module.params['port'], nessus_username)
+
+    adapter = PooledAdapter(module.params['pool_size'], module.params['max_retries'], module.params['retry_backoff'])
+    report_on_exit(module, 'http_retries', lambda: adapter.retry_count)
+
+    try:
+        # retries=0: pyTenable would otherwise retry every method itself, POSTs included
+        sc = TenableSC(server, port=module.params['port'], adapter=adapter, retries=0,
+                       timeout=(module.params['connect_timeout'], module.params['read_timeout']))
+    except Exception:
+        module.fail_json(msg='Issues connecting to Nessus.sc. Please check connectivity and credetials')
+
+    if metrics:
+        metrics.instrument(sc)
+
+    if cache:
+        state = cache.load()
+        if state and restore_session(sc, state):
+            return sc
+
+    try:
+        sc.login(nessus_username, nessus_password)
+    except Exception:
+        if cache:
+            cache.clear()
+        module.fail_json(msg='Issues connecting to Nessus.sc. Please check connectivity and credetials')
+
+    if cache:
+        try:
+            cache.save(sc)
+        except (IOError, OSError) as e:
+            module.warn('Unable to write Nessus.sc session cache ' + cache.path + ': ' + str(e))
+
+    return sc
+
+
+class NameIndex(object):
+    ''' name -> ID maps of Nessus.sc objects, optionally kept on disk for ttl seconds
+
+    Each object type listed in INDEX_SOURCES is downloaded at most once per
+    run (or once per ttl when a cache path is given). IDs are kept in the
+    order SC returns them, so several objects sharing a name (scan results)
+    are all available. Safe to share between worker threads.
+    '''
+
+    def __init__(self, sc, path=None, ttl=0):
+        self.sc = sc
+        self.path = path if ttl > 0 else None
+        self.ttl = ttl
+        self._names = {}
+        self._lower = {}
+        self._from_disk = set()
+        self._lock = threading.RLock()
+
+        state = read_private_json(self.path) if self.path else None
+        now = time.time()
+        for kind, entry in (state or {}).items():
+            if kind in INDEX_SOURCES and kind not in UNCACHED_KINDS and now - entry.get('fetched', 0) < ttl:
+                self._set(kind, entry['names'])
+                self._from_disk.add(kind)
+
+    def _set(self, kind, names):
+        self._names[kind] = names
+        lower = {}
+        for name, ids in names.items():
+            lower.setdefault(name.lower(), []).extend(ids)
+        self._lower[kind] = lower
+
+    def _save(self):
+        if not self.path:
+            return
+        state = read_private_json(self.path) or {}
+        now = time.time()
+        state = dict((kind, entry) for kind, entry in state.items()
+                     if now - entry.get('fetched', 0) < self.ttl)
+        for kind, names in self._names.items():
+            if kind not in self._from_disk and kind not in UNCACHED_KINDS:
+                state[kind] = dict(fetched=int(now), names=names)
+        try:
+            write_private_json(self.path, state)
+        except (IOError, OSError):
+            pass
+
+    def _drop_disk(self, kind):
+        if not self.path:
+            return
+        state = read_private_json(self.path)
+        if state and kind in state:
+            del state[kind]
+            try:
+                write_private_json(self.path, state)
+            except (IOError, OSError):
+                pass
+
+    def refresh(self, kind):
+        with self._lock:
+            names = {}
+            for item in INDEX_SOURCES[kind](self.sc):
+                names.setdefault(item['name'], []).append(int(item['id']))
+            self._set(kind, names)
+            self._from_disk.discard(kind)
+            self._save()
+            return names
+
+    def names(self, kind):
+        with self._lock:
+            if kind not in self._names:
+                self.refresh(kind)
+            return self._names[kind]
+
+    def ids(self, kind, name, ignore_case=False):
+        ''' All IDs of the objects called name, refreshing a disk cache miss once '''
+        with self._lock:
+            self.names(kind)
+            found = self._lookup(kind, name, ignore_case)
+            if not found and kind in self._from_disk:
+                self.refresh(kind)
+                found = self._lookup(kind, name, ignore_case)
+            return found
+
+    def _lookup(self, kind, name, ignore_case):
+        if ignore_case:
+            return list(self._lower[kind].get(name.lower(), []))
+        return list(self._names[kind].get(name, []))
+
+    def get(self, kind, name, ignore_case=False):
+        ''' First ID of the objects called name or None '''
+        found = self.ids(kind, name, ignore_case)
+        return found[0] if found else None
+
+    def latest(self, kind, name, ignore_case=False):
+        ''' Last ID of the objects called name or None (newest scan result) '''
+        found = self.ids(kind, name, ignore_case)
+        return found[-1] if found else None
+
+    def with_id(self, kind, name, call, ignore_case=False):
+        ''' call(ID of name), or call(None) when there is no such object
+
+        An ID read from the disk cache may belong to an object deleted
+        since: when call fails with not found, kind is listed again and
+        call runs once more with the current ID.
+        '''
+        object_id = self.get(kind, name, ignore_case)
+        from_disk = kind in self._from_disk
+        try:
+            return call(object_id)
+        except Exception as e:
+            if object_id is None or not from_disk or not is_not_found(e):
+                raise
+            self.refresh(kind)
+            fresh_id = self.get(kind, name, ignore_case)
+            if fresh_id == object_id:
+                raise
+            return call(fresh_id)
+
+    def search(self, kind, text):
+        ''' First ID whose name contains text, case insensitive '''
+        found = self.get(kind, text, ignore_case=True)
+        if found is not None:
+            return found
+        text = text.lower()
+        with self._lock:
+            for name, ids in self._lower[kind].items():
+                if text in name:
+                    return ids[0]
+        return None
+
+    def invalidate(self, kind):
+        ''' Forget a type after objects of that type are created or deleted '''
+        with self._lock:
+            self._names.pop(kind, None)
+            self._lower.pop(kind, None)
+            self._from_disk.discard(kind)
+            self._drop_disk(kind)
+
+    def created(self, kind, name, object_id):
+        ''' Record an object this run created, without listing its type again
+
+        The cached copy on disk is dropped so other runs list the type again.
+        '''
+        with self._lock:
+            if kind in self._names:
+                self._names[kind].setdefault(name, []).append(int(object_id))
+                self._lower[kind].setdefault(name.lower(), []).append(int(object_id))
+            self._drop_disk(kind)
+
+    def deleted(self, kind, object_id):
+        ''' Record an object this run deleted, see created() '''
+        object_id = int(object_id)
+        with self._lock:
+            for names in (self._names.get(kind, {}), self._lower.get(kind, {})):
+                for name in list(names):
+                    if object_id in names[name]:
+                        names[name] = [i for i in names[name] if i != object_id]
+                        if not names[name]:
+                            del names[name]
+            self._drop_disk(kind)
+
+
+def sc_name_index(module, sc):
+    ''' NameIndex for the server, port and user of module, cached in cache_dir for cache_ttl seconds '''
+    key = cache_key(module.params['server'], module.params['port'], module.params['nessus_username'])
+    path = os.path.join(os.path.expanduser(module.params['cache_dir']), 'index-' + key + '.json')
+    return NameIndex(sc, path, module.params['cache_ttl'])
+
+
+class ScanWaitTimeout(Exception):
+    pass
+
+
+def wait_for_scan_result(sc, scan_id, timeout, interval=10, max_interval=300, fields=None, on_poll=None):
+    ''' Poll scan result scan_id until it reaches a terminal status and return its details
+
+    Only the requested fields (status by default) are asked for on every
+    poll. The delay between polls starts at interval and grows by half on
+    each poll up to max_interval, never sleeping past the timeout.
+    on_poll(details, elapsed) is called after every poll.
+    '''
+    fields = list(fields or ['status'])
+    if 'status' not in fields:
+        fields.append('status')
+
+    started = time.time()
+    delay = interval
+    while True:
+        details = sc.scan_instances.details(int(scan_id), fields=fields)
+        elapsed = time.time() - started
+        if on_poll:
+            on_poll(details, elapsed)
+        if str(details['status']).lower() in TERMINAL_SCAN_STATUS:
+            return details
+
+        remaining = timeout - elapsed
+        if remaining <= 0:
+            raise ScanWaitTimeout('Nessus.sc scan result ' + str(scan_id) + ' still ' + str(details['status'])
+                                  + ' after ' + str(int(elapsed)) + ' seconds')
+        sleep(min(delay, remaining))
+        delay = min(delay * 1.5, max_interval)
+
+
+def parse_since(since):
+    ''' Seconds in a time window such as 90m, 12h, 7d or 2w (days when no unit), None for all '''
+    if since is None or str(since).strip().lower() in ('', 'all'):
+        return None
+    match = re.match(r'^\s*(\d+)\s*([smhdw]?)\s*$', str(since).lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError('Invalid time window: ' + str(since) + ' (expected e.g. 12h, 7d or 2w)')
+    return int(match.group(1)) * TIME_UNITS[match.group(2) or 'd']
+
+
+def find_scan_results(sc, since, names=None, pattern=None, expand=True):
+    ''' Newest scan result ID of each name (and of each name matching pattern) created within since seconds
+
+    Names are searched in the last since seconds first; the window grows
+    four times on every pass while some names are still missing, and the
+    full scan result history is only listed once the window goes over a
+    year. Without expand, or for pattern, only the first window is
+    searched. Returns {name: id}.
+    '''
+    wanted = set(names or [])
+    found = {}
+    newest = {}
+    window = since
+
+    while True:
+        now = int(time.time())
+        if window is None or window > MAX_WINDOW:
+            items = sc.scan_instances.list(start_time=1, fields=['id', 'name', 'createdTime'])['usable']
+        else:
+            items = sc.scan_instances.list(start_time=now - window, end_time=now,
+                                           fields=['id', 'name', 'createdTime'])['usable']
+
+        for item in items:
+            name = item['name']
+            if name not in wanted and not (pattern and window == since and pattern.search(name)):
+                continue
+            key = (int(item.get('createdTime') or 0), int(item['id']))
+            if name not in newest or key > newest[name]:
+                newest[name] = key
+                found[name] = int(item['id'])
+
+        if not expand or window is None or window > MAX_WINDOW or wanted.issubset(found):
+            return found
+        window *= 4
@@ -0,0 +1,469 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Nessus.sc scan definitions: resolving policy, asset list and credential
+# names against the shared name index, creating and launching the scans.
+
+import heapq
+import re
+import time
+
+from ansible.module_utils.nessus_assets import format_ip_range, merge_ip_ranges, parse_ip_entry, unique
+from ansible.module_utils.nessus_metrics import sleep
+from ansible.module_utils.nessus_sc import TERMINAL_SCAN_STATUS, is_not_found, run_concurrently
+
+
+# suboptions of one entry of the scans list of nessus-create-scan
+SCAN_DEFINITION_SPEC = dict(
+    scan_name=dict(type='str', required=True),
+    policy_name=dict(type='str', required=True),
+    targets=dict(type='list', required=False),
+    assets=dict(type='list', required=False),
+    credentials=dict(type='list', required=False)
+    )
+SHARD_BY = ['count', 'subnet']
+
+
+class ScanError(Exception):
+    pass
+
+
+class LaunchQueueError(ScanError):
+    ''' launch_queue() stopped by an API error, statuses holds the scans launched so far '''
+
+    def __init__(self, message, statuses):
+        super(LaunchQueueError, self).__init__(message)
+        self.statuses = statuses
+
+
+def resolve_scan_definition(index, definition):
+    ''' IDs of the policy, asset lists and credentials named by a scan definition '''
+    policy_name = definition['policy_name']
+
+    # listing policies and getting the policy ID
+    policy_id = index.get('policies', policy_name, ignore_case=True)
+    if policy_id is None:
+        raise ScanError('Nessus Policy not found: [' + policy_name + ']')
+
+    # listing assets or ips to create the target list
+    asset_ids = []
+    for asset in definition.get('assets') or []:
+        asset_id = index.search('asset_lists', asset)
+        if asset_id is None:
+            raise ScanError('Nessus.sc asset list does not exists: [' + asset + ']')
+        asset_ids.append(asset_id)
+
+    credential_ids = []
+    for user in definition.get('credentials') or []:
+        credential_id = index.search('credentials', user)
+        if credential_id is None:
+            raise ScanError('Nessus.sc user credentials does not exists: [' + user + ']')
+        credential_ids.append(credential_id)
+
+    if not definition.get('targets') and not asset_ids:
+        raise ScanError('Nessus.sc scan needs targets or assets: [' + definition['scan_name'] + ']')
+
+    return dict(policy_id=policy_id, asset_ids=asset_ids, credential_ids=credential_ids)
+
+
+def create_scan(sc, index, scan_name, policy_id, targets=None, asset_ids=None, credential_ids=None, repo=1, zone=None):
+    ''' Create a scan and return its ID, taken from the create response '''
+    scan_options = dict(policy_id=policy_id)
+    if zone is not None:
+        scan_options['scan_zone'] = zone
+    if targets:
+        scan_options['targets'] = targets
+    if asset_ids:
+        scan_options['asset_lists'] = asset_ids
+    if credential_ids:
+        # authenticated scan
+        scan_options['creds'] = credential_ids
+
+    scan_id = int(sc.scans.create(scan_name, repo, **scan_options)['id'])
+    index.created('scans', scan_name, scan_id)
+    return scan_id
+
+
+def create_scans(sc, index, definitions, workers=1):
+    ''' Create every scan definition that does not exist yet
+
+    Policy, asset list, credential and scan names are all resolved against
+    a single listing of each type, then the missing scans are created on
+    up to workers threads. Returns {scan_name: status} where status holds
+    state (created, exists or failed) and scan_id or error.
+    '''
+    for kind in ('policies', 'asset_lists', 'credentials', 'scans'):
+        index.names(kind)
+
+    counts = {}
+    for definition in definitions:
+        counts[definition['scan_name']] = counts.get(definition['scan_name'], 0) + 1
+
+    statuses = {}
+    jobs = []
+    for definition in definitions:
+        scan_name = definition['scan_name']
+        if counts[scan_name] > 1:
+            statuses[scan_name] = dict(state='failed', error='Duplicated scan definition: [' + scan_name + ']')
+            continue
+
+        scan_id = index.get('scans', scan_name)
+        if scan_id is not None:
+            statuses[scan_name] = dict(state='exists', scan_id=scan_id)
+            continue
+
+        try:
+            jobs.append((definition, resolve_scan_definition(index, definition)))
+        except ScanError as e:
+            statuses[scan_name] = dict(state='failed', error=str(e))
+
+    def create(job):
+        definition, ids = job
+        return create_scan(sc, index, definition['scan_name'], ids['policy_id'], definition.get('targets'),
+                           ids['asset_ids'], ids['credential_ids'])
+
+    for (definition, ids), scan_id, error in run_concurrently(create, jobs, workers):
+        if error:
+            statuses[definition['scan_name']] = dict(state='failed', error=error)
+        else:
+            statuses[definition['scan_name']] = dict(state='created', scan_id=scan_id)
+
+    return statuses
+
+
+def expand_asset_lists(sc, asset_ids):
+    ''' Hosts (ips, ranges and hostnames) defined in static and DNS asset lists '''
+    hosts = []
+    for asset_id in asset_ids:
+        details = sc.asset_lists.details(asset_id, fields=['id', 'name', 'type', 'definedIPs', 'definedDNSNames'])
+        if details.get('type') == 'static':
+            defined = details.get('definedIPs')
+        elif details.get('type') == 'dnsname':
+            defined = details.get('definedDNSNames')
+        else:
+            raise ScanError('Only static and DNS asset lists can be sharded: [' + str(details.get('name')) + ']')
+        hosts.extend(v for v in re.split(r'[,\s]+', defined or '') if v)
+    return hosts
+
+
+def split_targets(targets):
+    ''' Merged (version, first, last) ip ranges and unique lowercase hostnames of targets '''
+    ranges = []
+    names = []
+    for target in targets:
+        try:
+            ranges.append(parse_ip_entry(target))
+        except ValueError:
+            if target.strip():
+                names.append(target.strip().lower())
+    return merge_ip_ranges(ranges), unique(names)
+
+
+def host_count(ranges, names):
+    ''' Number of hosts of the (version, first, last) ip ranges and hostnames '''
+    return sum(last - first + 1 for _, first, last in ranges) + len(names)
+
+
+def target_hosts(targets):
+    ''' Number of hosts of targets (ips, CIDRs, ranges and hostnames), each counted once '''
+    return host_count(*split_targets(targets))
+
+
+def shard_by_count(ranges, names, shards):
+    ''' Consecutive slices of about the same number of hosts, ip ranges being cut as needed '''
+    total = host_count(ranges, names)
+    size = max(1, -(-total // shards))
+
+    buckets = [[]]
+    room = size
+    for version, first, last in ranges:
+        while first <= last:
+            if not room:
+                buckets.append([])
+                room = size
+            take = min(room, last - first + 1)
+            buckets[-1].extend(format_ip_range(version, first, first + take - 1))
+            first += take
+            room -= take
+    for name in names:
+        if not room:
+            buckets.append([])
+            room = size
+        buckets[-1].append(name)
+        room -= 1
+    return [bucket for bucket in buckets if bucket]
+
+
+def shard_by_subnet(ranges, names, shards, prefix=24, ipv6_prefix=64):
+    ''' Whole subnets (or DNS domains) packed into shards of about the same number of hosts
+
+    ip ranges are cut at /prefix (IPv4) or /ipv6_prefix (IPv6) boundaries
+    and hostnames grouped by parent domain; the groups are then handed out
+    biggest first to the least loaded shard.
+    '''
+    groups = {}
+    for version, first, last in ranges:
+        block = 1 << ((32 - prefix) if version == 4 else (128 - ipv6_prefix))
+        while first <= last:
+            end = min(last, (first // block + 1) * block - 1)
+            group = groups.setdefault((version, first // block), [0, [], []])
+            group[0] += end - first + 1
+            group[1].append((version, first, end))
+            first = end + 1
+    for name in names:
+        group = groups.setdefault(('dns', name.split('.', 1)[-1]), [0, [], []])
+        group[0] += 1
+        group[2].append(name)
+
+    bins = [(0, n, [], []) for n in range(shards)]
+    for weight, group_ranges, group_names in sorted(groups.values(), key=lambda g: -g[0]):
+        load, n, bin_ranges, bin_names = heapq.heappop(bins)
+        bin_ranges.extend(group_ranges)
+        bin_names.extend(group_names)
+        heapq.heappush(bins, (load + weight, n, bin_ranges, bin_names))
+
+    buckets = []
+    for load, n, bin_ranges, bin_names in sorted(bins, key=lambda b: b[1]):
+        bucket = []
+        for version, first, last in merge_ip_ranges(bin_ranges):
+            bucket.extend(format_ip_range(version, first, last))
+        bucket.extend(bin_names)
+        if bucket:
+            buckets.append(bucket)
+    return buckets
+
+
+def shard_targets(targets, shards, shard_by='count', prefix=24):
+    ''' Split targets into at most shards lists of balanced size '''
+    ranges, names = split_targets(targets)
+    if shard_by == 'subnet':
+        return shard_by_subnet(ranges, names, shards, prefix)
+    return shard_by_count(ranges, names, shards)
+
+
+def shard_name(scan_name, number):
+    return scan_name + '-shard-' + str(number)
+
+
+def scan_targets_match(details, targets, repo, zone):
+    ''' True if the scan details already target targets in repository repo and zone (unless None) '''
+    current = set(v.lower() for v in re.split(r'[,\s]+', details.get('ipList') or '') if v)
+    if current != set(target.lower() for target in targets):
+        return False
+    if str((details.get('repository') or {}).get('id')) != str(repo):
+        return False
+    return zone is None or str((details.get('zone') or {}).get('id')) == str(zone)
+
+
+def sync_scan_shard(sc, index, name, policy_id, targets, credential_ids, repo, zone):
+    ''' Create the shard scan name, or edit the existing one when its targets, repository or zone differ '''
+    def sync(scan_id):
+        if scan_id is None:
+            return dict(state='created', scan_id=create_scan(sc, index, name, policy_id, targets, None,
+                                                             credential_ids, repo, zone))
+        details = sc.scans.details(scan_id, fields=['id', 'ipList', 'repository', 'zone'])
+        if scan_targets_match(details, targets, repo, zone):
+            return dict(state='exists', scan_id=scan_id)
+        scan_options = dict(targets=targets, repo=repo)
+        if zone is not None:
+            scan_options['scan_zone'] = zone
+        sc.scans.edit(scan_id, **scan_options)
+        return dict(state='updated', scan_id=scan_id)
+    return index.with_id('scans', name, sync)
+
+
+def create_sharded_scan(sc, index, definition, shards, shard_by='count', prefix=24,
+                        repositories=None, zones=None, workers=1):
+    ''' Create definition as up to shards scans <scan_name>-shard-k over balanced target slices
+
+    Targets and the hosts of static/DNS asset lists are split by host
+    count or by subnet; shard k goes to repositories[k] and zones[k]
+    (round robin). Existing shards are edited when their targets,
+    repository or zone changed and the shards left over from a previous
+    run with more shards are deleted. Returns {shard name: status} with
+    state (created, updated, exists, deleted or failed), scan_id or error
+    and the number of hosts of every shard.
+    '''
+    ids = resolve_scan_definition(index, definition)
+    targets = list(definition.get('targets') or []) + expand_asset_lists(sc, ids['asset_ids'])
+    buckets = shard_targets(targets, shards, shard_by, prefix)
+    repositories = repositories or [1]
+    zones = zones or [None]
+
+    # listed once before the workers share it
+    existing = dict((name, list(scan_ids)) for name, scan_ids in index.names('scans').items())
+    jobs = [(shard_name(definition['scan_name'], n + 1), bucket, repositories[n % len(repositories)],
+             zones[n % len(zones)]) for n, bucket in enumerate(buckets)]
+
+    def sync(job):
+        name, bucket, repo, zone = job
+        return sync_scan_shard(sc, index, name, ids['policy_id'], bucket, ids['credential_ids'], repo, zone)
+
+    statuses = {}
+    for (name, bucket, repo, zone), status, error in run_concurrently(sync, jobs, workers):
+        if error:
+            status = dict(state='failed', error=error)
+        status['hosts'] = target_hosts(bucket)
+        statuses[name] = status
+
+    # drop the shards a previous run with more shards created
+    stale = re.compile('^' + re.escape(shard_name(definition['scan_name'], '')) + r'(\d+)$')
+    for name in sorted(existing):
+        match = stale.match(name)
+        if match and int(match.group(1)) > len(buckets):
+            for scan_id in index.ids('scans', name):
+                try:
+                    sc.scans.delete(scan_id)
+                except Exception as e:
+                    # already deleted, only the cached listing had it
+                    if not is_not_found(e):
+                        statuses[name] = dict(state='failed', scan_id=scan_id, error=str(e))
+                        continue
+                index.deleted('scans', scan_id)
+                statuses[name] = dict(state='deleted', scan_id=scan_id)
+
+    return statuses
+
+
+def launch_scan(sc, index, scan_id):
+    ''' Launch scan scan_id and return the ID of the scan result it started '''
+    launched = sc.scans.launch(int(scan_id))
+    index.invalidate('scan_instances')
+    return int(launched['scanResult']['id'])
+
+
+def launch_named_scan(sc, index, scan_name):
+    ''' launch_scan() of the scan called scan_name, returning its ID and the scan result ID
+
+    A scan ID cached on disk for a scan deleted since is looked up again
+    (NameIndex.with_id).
+    '''
+    def launch(scan_id):
+        if scan_id is None:
+            raise ScanError('Nessus scan not found: [' + scan_name + ']')
+        return scan_id, launch_scan(sc, index, scan_id)
+    return index.with_id('scans', scan_name, launch)
+
+
+def launch_queue(sc, index, scans, max_concurrent, timeout, interval=10, max_interval=60, log=None):
+    ''' Launch the (name, scan_id) scans in order keeping at most max_concurrent of them running
+
+    The status of every scan result this run started is read from a single
+    scan result listing per poll; the next queued scan is launched as soon
+    as one of them reaches a terminal status. Polls start every interval
+    seconds and slow down by half up to max_interval while nothing changes.
+    Returns {name: status} with state (launched, failed, or queued when
+    timeout seconds passed before it could start), scan_id, instance_id,
+    the last scan result status and the launched/finished offsets in seconds.
+    A failed poll raises LaunchQueueError with the statuses so far.
+    '''
+    queue = list(scans)
+    running = {}
+    statuses = {}
+    started = time.time()
+    # small margin for clock differences with SC
+    list_since = int(started) - 300
+    delay = interval
+
+    while queue or running:
+        while queue and len(running) < max_concurrent:
+            name, scan_id = queue.pop(0)
+            try:
+                scan_id, instance_id = launch_named_scan(sc, index, name)
+            except Exception as e:
+                statuses[name] = dict(state='failed', scan_id=scan_id, error=str(e) or e.__class__.__name__)
+                continue
+            running[instance_id] = name
+            statuses[name] = dict(state='launched', scan_id=scan_id, instance_id=instance_id,
+                                  status='Queued', launched=int(time.time() - started))
+            if log:
+                log('Nessus.sc scan [' + name + '] launched, scan result ' + str(instance_id))
+
+        if not running:
+            break
+
+        elapsed = time.time() - started
+        if elapsed >= timeout:
+            break
+        sleep(min(delay, timeout - elapsed))
+
+        try:
+            items = sc.scan_instances.list(start_time=list_since, fields=['id', 'status'])['usable']
+        except Exception as e:
+            for name, scan_id in queue:
+                statuses[name] = dict(state='queued', scan_id=scan_id)
+            raise LaunchQueueError('Issues polling the Nessus.sc scan results: ' + (str(e) or e.__class__.__name__),
+                                   statuses)
+        current = dict((int(item['id']), item['status']) for item in items)
+        freed = False
+        for instance_id in list(running):
+            if instance_id not in current:
+                continue
+            status = statuses[running[instance_id]]
+            status['status'] = current[instance_id]
+            if str(current[instance_id]).lower() in TERMINAL_SCAN_STATUS:
+                status['finished'] = int(time.time() - started)
+                del running[instance_id]
+                freed = True
+        delay = interval if freed else min(delay * 1.5, max_interval)
+
+    for name, scan_id in queue:
+        statuses[name] = dict(state='queued', scan_id=scan_id)
+    return statuses
+
+
+# scan result fields read on every poll of launch-and-wait
+PROGRESS_FIELDS = ['status', 'createdTime', 'startTime', 'finishTime', 'totalIPs', 'scannedIPs', 'completedIPs']
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class ScanProgress(object):
+    ''' Timing and progress of a scan result built from its status polls
+
+    Pass on_poll to wait_for_scan_result(). A sample (elapsed seconds,
+    status, completed ips) is only kept when the status or the number of
+    completed ips moved, so long waits do not grow the result.
+    '''
+
+    def __init__(self):
+        self.polls = 0
+        self.samples = []
+        self.details = {}
+
+    def on_poll(self, details, elapsed):
+        self.polls += 1
+        self.details = details
+        sample = dict(elapsed=int(elapsed), status=details.get('status'),
+                      completed_ips=to_int(details.get('completedIPs')))
+        last = self.samples[-1] if self.samples else None
+        if not last or (last['status'], last['completed_ips']) != (sample['status'], sample['completed_ips']):
+            self.samples.append(sample)
+
+    def summary(self):
+        ''' queue_time and run_time (seconds, SC clock), ip counts, hosts per minute, final status and samples '''
+        details = self.details
+        created = to_int(details.get('createdTime'))
+        start = to_int(details.get('startTime'))
+        finish = to_int(details.get('finishTime'))
+        completed = to_int(details.get('completedIPs'))
+
+        progress = dict(
+            status=details.get('status'),
+            total_ips=to_int(details.get('totalIPs')),
+            scanned_ips=to_int(details.get('scannedIPs')),
+            completed_ips=completed,
+            queue_time=start - created if created and start else None,
+            run_time=finish - start if start and finish >= start else None,
+            hosts_per_minute=None,
+            polls=self.polls,
+            samples=self.samples
+            )
+        if progress['run_time']:
+            progress['hosts_per_minute'] = round(completed * 60.0 / progress['run_time'], 2)
+        return progress
@@ -0,0 +1,199 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Local SQLite store of the findings of every fetched scan result. Each
+# scan result (instance) is loaded once, its findings keyed by host,
+# plugin, port and protocol, so the new, fixed and persisting findings of
+# a scan are one indexed join between two instances instead of a
+# comparison of two full .nessus reports.
+
+import sqlite3
+import time
+
+from ansible.module_utils.nessus_findings import iter_findings
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scan_instances (
+    instance_id INTEGER PRIMARY KEY,
+    scan_name TEXT NOT NULL,
+    finish_time INTEGER NOT NULL,
+    findings INTEGER NOT NULL,
+    loaded_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scan_instances_by_name ON scan_instances (scan_name, finish_time, instance_id);
+CREATE TABLE IF NOT EXISTS findings (
+    instance_id INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    plugin_id INTEGER NOT NULL,
+    port INTEGER NOT NULL,
+    protocol TEXT NOT NULL,
+    host_ip TEXT,
+    plugin_name TEXT,
+    severity INTEGER,
+    svc_name TEXT,
+    cves TEXT,
+    PRIMARY KEY (instance_id, host, plugin_id, port, protocol)
+) WITHOUT ROWID;
+'''
+
+UPSERT_FINDING = '''
+INSERT OR REPLACE INTO findings
+    (instance_id, host, plugin_id, port, protocol, host_ip, plugin_name, severity, svc_name, cves)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# every finding of both instances in a single pass: the current ones
+# joined on the primary key of the previous instance (new or persisting),
+# then the previous ones missing from the current instance (fixed)
+DELTA_QUERY = '''
+SELECT CASE WHEN p.instance_id IS NULL THEN 'new' ELSE 'persisting' END,
+       c.host, c.host_ip, c.plugin_id, c.plugin_name, c.severity, c.port, c.protocol
+FROM findings c
+LEFT JOIN findings p
+    ON p.instance_id = :previous AND p.host = c.host AND p.plugin_id = c.plugin_id
+    AND p.port = c.port AND p.protocol = c.protocol
+WHERE c.instance_id = :current
+UNION ALL
+SELECT 'fixed', p.host, p.host_ip, p.plugin_id, p.plugin_name, p.severity, p.port, p.protocol
+FROM findings p
+WHERE p.instance_id = :previous AND NOT EXISTS (
+    SELECT 1 FROM findings c
+    WHERE c.instance_id = :current AND c.host = p.host AND c.plugin_id = p.plugin_id
+    AND c.port = p.port AND c.protocol = p.protocol)
+'''
+
+DELTA_FIELDS = ['host', 'host_ip', 'plugin_id', 'plugin_name', 'severity', 'port', 'protocol']
+
+
+def delta_order(finding):
+    ''' Most severe first, then by host, plugin and port '''
+    return (-(finding['severity'] or 0), finding['host'], finding['plugin_id'], finding['port'])
+
+
+class TopFindings(object):
+    ''' The limit first findings in delta_order() of the ones added, in memory bounded by limit '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.findings = []
+
+    def add(self, finding):
+        self.findings.append(finding)
+        # trimmed every limit additions, at most 2 * limit findings are kept
+        if len(self.findings) >= 2 * self.limit:
+            self.trim()
+
+    def trim(self):
+        self.findings.sort(key=delta_order)
+        del self.findings[self.limit:]
+        return self.findings
+
+
+def finding_row(instance_id, finding):
+    return (instance_id, finding['host'] or '', finding['plugin_id'], finding['port'], finding['protocol'] or '',
+            finding['host_ip'], finding['plugin_name'], finding['severity'], finding['svc_name'],
+            ';'.join(finding['cves']))
+
+
+class FindingsStore(object):
+    ''' SQLite database of the findings of the scan results loaded so far
+
+    Several modules (or workers) can use the same database: it is opened in
+    WAL mode and writers wait up to timeout seconds for each other.
+    '''
+
+    def __init__(self, path, timeout=300):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def instance(self, instance_id):
+        ''' (scan_name, finish_time, findings) of a loaded scan result or None '''
+        return self.db.execute('SELECT scan_name, finish_time, findings FROM scan_instances WHERE instance_id = ?',
+                               (instance_id,)).fetchone()
+
+    def load(self, instance_id, scan_name, finish_time, report):
+        ''' Replace the findings of instance_id by the ones of the .nessus file report
+
+        Returns the number of findings stored. Done in one transaction, a
+        failed load leaves the previous content of the instance in place.
+        '''
+        with self.db:
+            self.db.execute('DELETE FROM findings WHERE instance_id = ?', (instance_id,))
+            self.db.executemany(UPSERT_FINDING, (finding_row(instance_id, finding)
+                                                 for finding in iter_findings(report)))
+            count = self.db.execute('SELECT COUNT(*) FROM findings WHERE instance_id = ?',
+                                    (instance_id,)).fetchone()[0]
+            self.db.execute('INSERT OR REPLACE INTO scan_instances VALUES (?, ?, ?, ?, ?)',
+                            (instance_id, scan_name, finish_time, count, int(time.time())))
+        return count
+
+    def previous_instance(self, instance_id):
+        ''' ID of the loaded scan result of the same scan finished right before instance_id '''
+        row = self.db.execute('''
+            SELECT p.instance_id FROM scan_instances c
+            JOIN scan_instances p ON p.scan_name = c.scan_name
+                AND (p.finish_time < c.finish_time OR p.finish_time = c.finish_time AND p.instance_id < c.instance_id)
+            WHERE c.instance_id = ?
+            ORDER BY p.finish_time DESC, p.instance_id DESC
+            LIMIT 1''', (instance_id,)).fetchone()
+        return row[0] if row else None
+
+    def delta(self, instance_id, previous_id, limit=0):
+        ''' Counts of new, fixed and persisting findings
+
+        With limit, new_findings and fixed_findings also list the limit most
+        severe new and fixed findings.
+        '''
+        delta = dict(previous_id=previous_id, new=0, fixed=0, persisting=0)
+        top = dict(new=TopFindings(limit), fixed=TopFindings(limit)) if limit > 0 else None
+        for row in self.db.execute(DELTA_QUERY, dict(current=instance_id, previous=previous_id)):
+            status = row[0]
+            delta[status] += 1
+            if top and status != 'persisting':
+                top[status].add(dict(zip(DELTA_FIELDS, row[1:])))
+        if top:
+            delta['new_findings'] = top['new'].trim()
+            delta['fixed_findings'] = top['fixed'].trim()
+        return delta
+
+
+def store_findings(path, report, scan_name, delta_limit=0):
+    ''' Load report['output'] into the findings database path, unless already there
+
+    A scan result already loaded with the same finish time is not parsed
+    again. Returns the findings count, changed and, once a previous scan
+    result of the same scan is stored, its delta (see FindingsStore.delta).
+    '''
+    instance_id = int(report['scan_id'])
+    try:
+        finish_time = int(report.get('finish_time'))
+    except (TypeError, ValueError):
+        finish_time = 0
+
+    with FindingsStore(path) as store:
+        loaded = store.instance(instance_id)
+        if loaded and loaded[1] == finish_time:
+            count = loaded[2]
+            changed = False
+        else:
+            count = store.load(instance_id, scan_name, finish_time, report['output'])
+            changed = True
+
+        stored = dict(findings_db=path, findings_stored=count, changed=changed)
+        previous_id = store.previous_instance(instance_id)
+        if previous_id is not None:
+            stored['delta'] = store.delta(instance_id, previous_id, delta_limit)
+    return stored
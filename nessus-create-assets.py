@@ -21,7 +21,8 @@ options:
     asset_name:
         description:
             - Nessus.sc asset name
-        required: true
+            - Required unless group_by is used
+        required: false
     asset_type:
         description:
             - Nessus.sc asset type: DNS or IP
@@ -35,10 +36,95 @@ options:
         description:
             - Location of the CSV file
         required: true
+    csv_engine:
+        description:
+            - stream reads the CSV file row by row keeping only the matching hostname or ip values, without pandas
+            - pandas loads the whole file into a DataFrame
+        required: false
+        choices: [ stream, pandas ]
+        default: stream
+    update_mode:
+        description:
+            - delta edits an existing asset list only when its hosts differ from the CSV ones, keeping its ID
+            - recreate deletes the existing asset list and creates it again (new ID)
+        required: false
+        choices: [ delta, recreate ]
+        default: delta
+    aggregate_ips:
+        description:
+            - For IP asset lists, merge contiguous addresses and networks into CIDR ranges
+            - IP entries are always parsed, duplicates and invalid values are dropped
+        required: false
+        default: true
+    group_by:
+        description:
+            - CSV column used to build one asset list per distinct value, reading the CSV file only once
+            - Always uses the stream csv_engine
+        required: false
+    name_template:
+        description:
+            - Name of the asset lists built with group_by, {group} is replaced by the group value
+            - Every group needs its own name, groups rendered to the same name are reported as failed
+        required: false
+        default: "{group}"
+    workers:
+        description:
+            - Maximum number of asset lists (groups or chunks) created or updated at the same time
+        required: false
+        default: 4
+    chunk_size:
+        description:
+            - Maximum number of entries sent in one request, 0 disables chunking
+            - A bigger list is split over asset lists named asset_name-001, asset_name-002, ...
+        required: false
+        default: 0
+    chunk_mode:
+        description:
+            - combine also creates asset_name as a combination asset list of all the chunks, so scans use a single asset list
+            - shard only creates the asset_name-NNN asset lists
+        required: false
+        choices: [ combine, shard ]
+        default: combine
+    chunk_retries:
+        description:
+            - Number of times a failed chunk is sent again before giving up
+        required: false
+        default: 3
     server:
         description:
             - Nessus.sc server name
         required: true
+    port:
+        description:
+            - Nessus.sc HTTPS port
+        required: false
+        default: 443
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to Nessus.sc
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for Nessus.sc to answer a call
+        required: false
+        default: 300
+    max_retries:
+        description:
+            - Retries of calls answered 429 or 5xx or whose connection failed, with jittered exponential backoff honouring Retry-After
+            - Creations and launches are only retried when Nessus.sc did not process them (connection failed or 429 answer)
+        required: false
+        default: 5
+    retry_backoff:
+        description:
+            - Seconds before the first retry, doubled on every retry
+        required: false
+        default: 1.0
+    pool_size:
+        description:
+            - Connections to Nessus.sc kept alive and reused between calls
+        required: false
+        default: 10
     username:
         description:
             - user with perms to create and launch scans in Nessus.sc server
@@ -47,9 +133,35 @@ options:
         description:
             - user's password
         required: true
+    session_cache:
+        description:
+            - Reuse the Nessus.sc session between module runs instead of logging in every time
+            - The session token is stored in a file only readable by the user running the module
+        required: false
+        default: true
+    cache_dir:
+        description:
+            - Folder holding the session cache files
+        required: false
+        default: ~/.ansible/nessus_sc
+    cache_ttl:
+        description:
+            - Seconds the name to ID lookups (scans, policies, assets and credentials) are cached in cache_dir, scan results are always listed again
+            - 0 disables the cache and lists the objects on every run
+        required: false
+        default: 300
+    metrics:
+        description:
+            - Return per API endpoint call counts, latency, bytes transferred and retries under metrics, with wall, API and sleep time totals
+        required: false
+        default: true
+    trace_file:
+        description:
+            - Append every Nessus.sc API call (endpoint, status, latency, bytes, retries) to this file as a JSON line
+        required: false
 notes:
 requirements:
-    - Requires the following modules to be installed: pyTenable and pandas
+    - Requires the following modules to be installed: pyTenable (and pandas for csv_engine=pandas)
     - Tested with Ansible 2.8.6 version and Python 2.7.16
 '''
 
@@ -65,6 +177,17 @@ EXAMPLES = '''
       username: api_nessus
       password: *****
   register: output
+
+- name: Create one Nessus.sc asset list per business unit
+  nessus-create-assets
+      asset_type: "IP"
+      group_by: "business_unit"
+      name_template: "BU {group} servers"
+      file_location: "/path/to/host_list.csv"
+      server: nessus.sc_server
+      username: api_nessus
+      password: *****
+  register: output
 '''
 
 
@@ -75,30 +198,37 @@ changed:
 output:
     description: Nessus.sc Asset list name
     type: JSON
+asset_id:
+    description: Nessus.sc asset list ID
+    type: int
+added:
+    description: Number of hosts added to the asset list
+    type: int
+removed:
+    description: Number of hosts removed from the asset list
+    type: int
+invalid:
+    description: CSV ip values dropped because they are not valid addresses, networks or ranges
+    type: list
+chunks:
+    description: With chunk_size, per chunk asset list name, asset_id, count, attempts, added and removed
+    type: list
+asset_lists:
+    description: With group_by, per asset list name result (asset_id, changed, added, removed, chunks) or error
+    type: dict
+http_retries:
+    description: Number of Nessus.sc calls retried by the HTTP transport
+    type: int
+metrics:
+    description: With metrics, wall_time, api_time, sleep_time, calls, errors, retries and bytes totals plus the same per endpoint (METHOD path)
+    type: dict
 '''
 
 
-import os
-import re
 from ansible.module_utils.basic import AnsibleModule
-import time
-import json
-
 
-
-try:
-    import pandas as pd
-    HAS_PANDAS = True
-except ImportError:
-    HAS_PANDAS = False
-
-
-
-try:
-    from tenable.sc import TenableSC
-    HAS_PYTENABLE = True
-except ImportError:
-    HAS_PYTENABLE = False
+from ansible.module_utils.nessus_assets import ASSET_COLUMNS, CSV_ENGINES, UPDATE_MODES, CHUNK_MODES, load_hosts, build_asset_list
+from ansible.module_utils.nessus_sc import HAS_PYTENABLE, nessus_sc_argument_spec, sc_connect, sc_name_index, run_concurrently
 
 
 
@@ -106,14 +236,21 @@ except ImportError:
 def run_module():
 
     module_args = dict(
-        asset_name=dict(type='str', required=True),
+        asset_name=dict(type='str', required=False),
         asset_type=dict(type='str', required=True),
         targets=dict(type='str', required=False, default='.*'),
         file_location=dict(type='str', required=True),
-        server=dict(type='str', required=True),
-        nessus_username=dict(type='str', required=True),
-        nessus_password=dict(type='str', required=True)
+        csv_engine=dict(type='str', required=False, default='stream', choices=CSV_ENGINES),
+        update_mode=dict(type='str', required=False, default='delta', choices=UPDATE_MODES),
+        aggregate_ips=dict(type='bool', required=False, default=True),
+        group_by=dict(type='str', required=False),
+        name_template=dict(type='str', required=False, default='{group}'),
+        workers=dict(type='int', required=False, default=4),
+        chunk_size=dict(type='int', required=False, default=0),
+        chunk_mode=dict(type='str', required=False, default='combine', choices=CHUNK_MODES),
+        chunk_retries=dict(type='int', required=False, default=3)
         )
+    module_args.update(nessus_sc_argument_spec())
 
     result = dict(
         changed=False,
@@ -123,6 +260,7 @@ def run_module():
 
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[['asset_name', 'group_by']],
         supports_check_mode=True
     )
 
@@ -130,9 +268,6 @@ def run_module():
     if not HAS_PYTENABLE:
         module.fail_json(msg = 'pyTenable required. pip install pytenable')
 
-    if not HAS_PANDAS:
-        module.fail_json(msg = 'Pandas required. pip install panda')
-
 
     if module.check_mode:
         module.exit_json(**result)
@@ -142,50 +277,89 @@ def run_module():
     asset_type = module.params['asset_type']
     targets = module.params['targets']
     file_location = module.params['file_location']
-    server = module.params['server']
-    nessus_username = module.params['nessus_username']
-    nessus_password = module.params['nessus_password']
+    csv_engine = module.params['csv_engine']
+    update_mode = module.params['update_mode']
+    group_by = module.params['group_by']
+    workers = module.params['workers']
 
+    def build(name, hosts, chunk_workers=1):
+        return build_asset_list(sc, index, name, column, hosts, update_mode,
+                                module.params['chunk_size'], module.params['chunk_mode'],
+                                module.params['chunk_retries'], chunk_workers, module.log)
 
-    try:
-        sc = TenableSC(server)
-        sc.login(nessus_username, nessus_password)
-    except:
-        module.fail_json(msg='Issues connecting to Nessus.sc. Please check connectivity and credetials')
+    column = ASSET_COLUMNS.get(asset_type.lower())
+    if column is None:
+        module.fail_json(msg='Nessus.sc asset type must be DNS or IP: [' + asset_type + ']')
 
     try:
-        df = pd.read_csv(file_location,low_memory=False)
-    except:
-        module.fail_json(msg='Issues loading CSV file' + file_location)
-
-
-    asset_list = sc.asset_lists.list()['usable']
-    asset_id = [item for item in asset_list if item["name"] == asset_name]
-
-    # overwrite existing asset list
-    if asset_id:
-        sc.asset_lists.delete(int(asset_id[0]['id']))
-
-
-    if asset_type.lower() == 'dns':
-        host_list = list(df[df['hostname'].str.contains(pat=targets)]['hostname'])
+        host_list, invalid = load_hosts(file_location, column, targets, csv_engine, module.params['aggregate_ips'],
+                                        group_by)
+    except ImportError:
+        module.fail_json(msg = 'Pandas required. pip install panda')
+    except Exception as e:
+        module.fail_json(msg='Issues loading CSV file ' + file_location + ': ' + str(e))
 
-        try:
-            sc.asset_lists.create(asset_name,list_type='dnsname',dns_names=host_list)
-        except:
-            module.fail_json(msg="Error creating Nessus asset list [" + asset_name + "]")
+    if invalid:
+        result['invalid'] = invalid
+        module.warn('Dropped ' + str(len(invalid)) + ' invalid ip values from ' + file_location)
 
-    elif asset_type.lower() == 'ip':
-        ip_list = list(df[df['ip'].str.contains(pat=targets)]['ip'])
 
+    if group_by:
+        name_template = module.params['name_template']
+        groups = {}
         try:
-            sc.asset_lists.create(asset_name,list_type='static',ips=ip_list)
-        except:
-            module.fail_json(msg="Error creating Nessus asset list [" + asset_name + "]")
+            for group in host_list:
+                groups.setdefault(name_template.format(group=group), []).append(group)
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
+            module.fail_json(msg='Invalid name_template [' + name_template + '], only {group} can be used: '
+                             + str(e))
+
+        # several groups rendered to the same name would sync one asset list at the same time
+        asset_lists = {}
+        jobs = []
+        for name, named in groups.items():
+            if len(named) > 1:
+                asset_lists[name] = dict(error='Duplicated asset list name for groups: [' + ', '.join(
+                    str(group) for group in named) + ']')
+            else:
+                jobs.append((name, host_list[named[0]]))
+
+
+    sc = sc_connect(module)
+    index = sc_name_index(module, sc)
+
+    if group_by:
+        # listed once before the workers share it
+        index.names('asset_lists')
+
+        for (name, hosts), asset, error in run_concurrently(
+                lambda job: build(*job), jobs, workers):
+            if error:
+                asset_lists[name] = dict(error=error)
+            else:
+                asset_lists[name] = asset
+                result['changed'] = result['changed'] or asset['changed']
+
+        result['asset_lists'] = asset_lists
+        result['output'] = "Nessus.sc Asset lists: [" + ', '.join(name for name, hosts in jobs) + "]"
+
+        failed = sorted(name for name in asset_lists if 'error' in asset_lists[name])
+        if failed:
+            module.fail_json(msg='Issues creating the Nessus.sc asset lists: [' + ', '.join(failed) + ']', **result)
+        module.exit_json(**result)
 
+    try:
+        asset = build(asset_name, host_list, workers)
+    except Exception as e:
+        module.fail_json(msg=str(e))
 
 
-    result['changed'] = True
+    result['changed'] = asset['changed']
+    result['asset_id'] = asset['asset_id']
+    result['added'] = asset['added']
+    result['removed'] = asset['removed']
+    if 'chunks' in asset:
+        result['chunks'] = asset['chunks']
     result['output'] = "Nessus.sc Asset list name: [" + asset_name + "]"
 
     module.exit_json(**result)
@@ -22,11 +22,13 @@ options:
     scan_name:
         description:
             - Nessus.sc scan name
-        required: true
+            - Required unless scans is used
+        required: false
     policy_name:
         description:
             - Nessus.sc policy name
-        required: true
+            - Required with scan_name
+        required: false
     targets:
         description:
             - Targets/remote servers to scan
@@ -39,10 +41,80 @@ options:
         description:
             - Optional credetials for authenticated scan
         required: false
+    scans:
+        description:
+            - List of scan definitions (scan_name, policy_name, targets, assets, credentials) created in a single run
+            - Policy, asset and credential names are resolved against a single listing of each, scans that already exist are skipped
+        required: false
+    workers:
+        description:
+            - Maximum number of scans (or shards) created at the same time
+        required: false
+        default: 4
+    shards:
+        description:
+            - Split the targets of scan_name into up to this number of scans named <scan_name>-shard-<k> that can run in parallel
+            - The hosts of the assets (static and DNS asset lists only) are added to the targets before splitting
+            - Shards that already exist are edited when their targets, repository or zone changed
+            - Shards numbered above the current number of shards, left over from a previous run, are deleted
+        required: false
+        default: 1
+    shard_by:
+        description:
+            - count cuts the targets in slices of the same number of hosts
+            - subnet keeps whole subnets (/shard_prefix) and DNS domains together in the same shard
+        required: false
+        default: count
+        choices: [ count, subnet ]
+    shard_prefix:
+        description:
+            - IPv4 prefix length of the subnets kept together with shard_by subnet
+        required: false
+        default: 24
+    repositories:
+        description:
+            - Repository IDs the scans import into, the shards are spread over them in turn
+        required: false
+        default: [ 1 ]
+    scan_zones:
+        description:
+            - Scan zone IDs the shards are spread over in turn, the scan default when not set
+        required: false
     server:
         description:
             - Nessus.sc server name
         required: true
+    port:
+        description:
+            - Nessus.sc HTTPS port
+        required: false
+        default: 443
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to Nessus.sc
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for Nessus.sc to answer a call
+        required: false
+        default: 300
+    max_retries:
+        description:
+            - Retries of calls answered 429 or 5xx or whose connection failed, with jittered exponential backoff honouring Retry-After
+            - Creations and launches are only retried when Nessus.sc did not process them (connection failed or 429 answer)
+        required: false
+        default: 5
+    retry_backoff:
+        description:
+            - Seconds before the first retry, doubled on every retry
+        required: false
+        default: 1.0
+    pool_size:
+        description:
+            - Connections to Nessus.sc kept alive and reused between calls
+        required: false
+        default: 10
     username:
         description:
             - user with perms to create and launch scans in Nessus.sc server
@@ -51,6 +123,32 @@ options:
         description:
             - user's password
         required: true
+    session_cache:
+        description:
+            - Reuse the Nessus.sc session between module runs instead of logging in every time
+            - The session token is stored in a file only readable by the user running the module
+        required: false
+        default: true
+    cache_dir:
+        description:
+            - Folder holding the session cache files
+        required: false
+        default: ~/.ansible/nessus_sc
+    cache_ttl:
+        description:
+            - Seconds the name to ID lookups (scans, policies, assets and credentials) are cached in cache_dir, scan results are always listed again
+            - 0 disables the cache and lists the objects on every run
+        required: false
+        default: 300
+    metrics:
+        description:
+            - Return per API endpoint call counts, latency, bytes transferred and retries under metrics, with wall, API and sleep time totals
+        required: false
+        default: true
+    trace_file:
+        description:
+            - Append every Nessus.sc API call (endpoint, status, latency, bytes, retries) to this file as a JSON line
+        required: false
 notes:
 requirements:
     - Requires the following module to be installed pyTenable
@@ -85,6 +183,30 @@ EXAMPLES = '''
       username: api_nessus
       password: *****
   register: output
+
+- name: Create Nessus.sc scan split over 4 scan zones
+  nessus-create-scan
+      scan_name: "Datacenter discovery"
+      policy_name: "Nessus Policy Discovery"
+      targets:
+         - 10.0.0.0/16
+      shards: 4
+      shard_by: subnet
+      repositories: [ 2, 3 ]
+      scan_zones: [ 1, 2, 3, 4 ]
+      server: Nessus.sc server name
+      username: api_nessus
+      password: *****
+  register: output
+
+- name: Create all the Nessus.sc scans of the estate
+  nessus-create-scan
+      scans: "{{ nessus_scan_definitions }}"
+      workers: 8
+      server: Nessus.sc server name
+      username: api_nessus
+      password: *****
+  register: output
 '''
 
 RETURN = '''
@@ -94,35 +216,48 @@ changed:
 output:
     description: Scan name and ID in Nessus.sc
     type: JSON
+scan_id:
+    description: ID of the created Nessus.sc scan
+    type: int
+scans:
+    description: With scans or shards, per scan name state (created, exists or failed; with shards also updated or deleted) and scan_id or error, plus the number of hosts of every shard
+    type: dict
+shard_ids:
+    description: With shards, IDs of all the current shard scans in shard order
+    type: list
+http_retries:
+    description: Number of Nessus.sc calls retried by the HTTP transport
+    type: int
+metrics:
+    description: With metrics, wall_time, api_time, sleep_time, calls, errors, retries and bytes totals plus the same per endpoint (METHOD path)
+    type: dict
 '''
 
 
-import os
-import re
 from ansible.module_utils.basic import AnsibleModule
-import time
-import json
 
-
-try:
-    from tenable.sc import TenableSC
-    HAS_PYTENABLE = True
-except ImportError:
-    HAS_PYTENABLE = False
+from ansible.module_utils.nessus_sc import HAS_PYTENABLE, nessus_sc_argument_spec, sc_connect, sc_name_index
+from ansible.module_utils.nessus_scans import (SCAN_DEFINITION_SPEC, SHARD_BY, ScanError, create_scan, create_scans,
+                                               create_sharded_scan, resolve_scan_definition, shard_name)
 
 
 def run_module():
 
     module_args = dict(
-        scan_name=dict(type='str', required=True),
-        server=dict(type='str', required=True),
-        policy_name=dict(type='str', required=True),
+        scan_name=dict(type='str', required=False),
+        policy_name=dict(type='str', required=False),
         targets=dict(type='list', required=False),
         assets=dict(type='list', required=False),
         credentials=dict(type='list', required=False),
-        nessus_username=dict(type='str', required=True),
-        nessus_password=dict(type='str', required=True)
+        scans=dict(type='list', elements='dict', required=False, options=SCAN_DEFINITION_SPEC),
+        workers=dict(type='int', required=False, default=4),
+        shards=dict(type='int', required=False, default=1),
+        shard_by=dict(type='str', required=False, default='count', choices=SHARD_BY),
+        shard_prefix=dict(type='int', required=False, default=24),
+        repositories=dict(type='list', elements='int', required=False, default=[1]),
+        scan_zones=dict(type='list', elements='int', required=False)
         )
+    module_args.update(nessus_sc_argument_spec())
 
     result = dict(
         changed=False,
@@ -132,6 +267,8 @@ def run_module():
 
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[['scan_name', 'scans']],
+        mutually_exclusive=[['scan_name', 'scans']],
         supports_check_mode=True
     )
 
@@ -142,90 +279,70 @@ def run_module():
         module.exit_json(**result)
 
 
-    scan_name = module.params['scan_name']
-    server = module.params['server']
-    policy_name = module.params['policy_name']
-    hosts_list = module.params['targets']
-    asset_list = module.params['assets']
-    credentials = module.params['credentials']
-    nessus_username = module.params['nessus_username']
-    nessus_password = module.params['nessus_password']
+    scans = module.params['scans']
+    workers = module.params['workers']
 
-    nessus_credentials_list = []
-    nessus_scan_asset_list = []
+    sc = sc_connect(module)
+    index = sc_name_index(module, sc)
 
-    try:
-        sc = TenableSC(server)
-        sc.login(nessus_username, nessus_password)
-    except:
-        module.fail_json(msg='Issues connectin to Nessus.sc. Please check connectivity and credetials')
 
+    if scans:
+        statuses = create_scans(sc, index, scans, workers)
 
-    # listing policies and getting the policy ID
-    policy_list = sc.policies.list()['usable']
-    policy_id = [i for i in policy_list if policy_name.lower() == (i['name']).lower()]
-    if policy_id:
-        nessus_policy_id = int(policy_id[0]['id'])
-    else:
-        module.fail_json(msg='Nessus Policy not found: [' + policy_name + ']')
+        result['scans'] = statuses
+        result['changed'] = any(status['state'] == 'created' for status in statuses.values())
+        result['output'] = "Nessus.sc Scans created: [" + ', '.join(
+            name for name, status in statuses.items() if status['state'] == 'created') + "]"
 
+        failed = [name for name, status in statuses.items() if status['state'] == 'failed']
+        if failed:
+            module.fail_json(msg='Issues creating the Nessus.sc scans: [' + ', '.join(failed) + ']', **result)
+        module.exit_json(**result)
 
-    # listing assets or ips to create the target list
-    nessus_asset_list = sc.asset_lists.list()['usable']
-    if asset_list:
-        for asset in asset_list:
-            scan_asset_list = [ i for i in nessus_asset_list if asset.lower() in i['name'].lower()]
-            if not scan_asset_list:
-                module.fail_json(msg='Nessus.sc asset list does not exists: [' + asset + ']')
-            nessus_scan_asset_list.append(int(scan_asset_list[0]['id']))
 
+    scan_name = module.params['scan_name']
+    definition = dict((key, module.params[key]) for key in SCAN_DEFINITION_SPEC)
+    if not definition['policy_name']:
+        module.fail_json(msg='policy_name is required with scan_name')
+
+    shards = module.params['shards']
+    if shards > 1:
+        try:
+            statuses = create_sharded_scan(sc, index, definition, shards, module.params['shard_by'],
+                                           module.params['shard_prefix'], module.params['repositories'],
+                                           module.params['scan_zones'], workers)
+        except ScanError as e:
+            module.fail_json(msg=str(e))
+
+        names = sorted((name for name in statuses if statuses[name]['state'] != 'deleted'),
+                       key=lambda name: int(name[len(shard_name(scan_name, '')):]))
+        result['scans'] = statuses
+        result['shard_ids'] = [statuses[name].get('scan_id') for name in names]
+        result['changed'] = any(status['state'] in ('created', 'updated', 'deleted') for status in statuses.values())
+        result['output'] = "Nessus.sc Scan Name: [" + scan_name + "] in " + str(len(names)) + " shards"
+
+        failed = sorted(name for name in statuses if statuses[name]['state'] == 'failed')
+        if failed:
+            module.fail_json(msg='Issues creating the Nessus.sc scan shards: [' + ', '.join(failed) + ']', **result)
+        module.exit_json(**result)
 
     # creating scan
-    scan_list = sc.scans.list()['usable']
-    scan_id = [item for item in scan_list if item["name"] == scan_name]
-    if scan_id:
-        nessus_scan_id = int(scan_id[0]['id'])
+    nessus_scan_id = index.get('scans', scan_name)
+    if nessus_scan_id is not None:
         module.fail_json(msg='Nessus.sc scan resutls already exists: [' + scan_name + ']')
-    else:
-
-        if credentials:
-            # authenticated scan
-            credentials_list =  sc.credentials.list()['usable']
-
-            for user in credentials:
-                nessus_credentials = [ i for i in credentials_list if user.lower() in i['name'].lower()]
-                if not nessus_credentials:
-                    module.fail_json(msg='Nessus.sc user credentials does not exists: [' + user + ']')
-                nessus_credentials_list.append(int(nessus_credentials[0]['id']))
-            if hosts_list:
-                sc.scans.create(scan_name, 1, policy_id=nessus_policy_id, targets=hosts_list, creds=nessus_credentials_list )
-                time.sleep(5)
-                scan_list = sc.scans.list()['usable']
-                scan_id = [item for item in scan_list if item["name"] == scan_name]
-                nessus_scan_id = int(scan_id[0]['id'])
-            if nessus_scan_asset_list:
-                sc.scans.create(scan_name, 1, policy_id=nessus_policy_id, asset_lists=nessus_scan_asset_list, creds=nessus_credentials_list )
-                time.sleep(5)
-                scan_list = sc.scans.list()['usable']
-                scan_id = [item for item in scan_list if item["name"] == scan_name]
-                nessus_scan_id = int(scan_id[0]['id'])
-        else:
-            # unauthenticated scan
-            if hosts_list:
-                sc.scans.create(scan_name, 1, policy_id=nessus_policy_id, targets=hosts_list )
-                time.sleep(5)
-                scan_list = sc.scans.list()['usable']
-                scan_id = [item for item in scan_list if item["name"] == scan_name]
-                nessus_scan_id = int(scan_id[0]['id'])
-            if nessus_scan_asset_list:
-                sc.scans.create(scan_name, 1, policy_id=nessus_policy_id, asset_lists=nessus_scan_asset_list)
-                time.sleep(5)
-                scan_list = sc.scans.list()['usable']
-                scan_id = [item for item in scan_list if item["name"] == scan_name]
-                nessus_scan_id = int(scan_id[0]['id'])
+
+    try:
+        ids = resolve_scan_definition(index, definition)
+    except ScanError as e:
+        module.fail_json(msg=str(e))
+
+    nessus_scan_id = create_scan(sc, index, scan_name, ids['policy_id'], definition['targets'],
+                                 ids['asset_ids'], ids['credential_ids'], module.params['repositories'][0],
+                                 (module.params['scan_zones'] or [None])[0])
 
 
     result['changed'] = True
+    result['scan_id'] = nessus_scan_id
     result['output'] = "Nessus.sc Scan Name: [" + scan_name + "]"
 
     module.exit_json(**result)
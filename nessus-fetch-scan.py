@@ -17,17 +17,119 @@ description:
     - This module connects and retrieves the scan results of a given scan name
     - The resulting file will be located in the same folder where the playbook runs from
     - Scan results file name: scan_name.nessus
+    - The export is decompressed while it downloads and the report only appears once complete
 version_added: "2.4"
 author: Jesus Fonteboa (@hiperesfera)
 options:
     scan_name:
         description:
             - Nessus.sc scan name
-        required: true
+            - One of scan_name, scan_names, scan_pattern or instance_id is required
+        required: false
+    instance_id:
+        description:
+            - ID of the scan result to fetch, as returned by nessus-launch-scan
+            - No scan result listing is done, the report is saved as scan_name.nessus or under the name of the scan result
+        required: false
+    scan_names:
+        description:
+            - List of Nessus.sc scan names fetched concurrently in a single run
+        required: false
+    scan_pattern:
+        description:
+            - Regex expresion, fetch every scan result whose name matches it
+        required: false
+    workers:
+        description:
+            - Maximum number of scan results downloaded at the same time
+        required: false
+        default: 4
+    incremental:
+        description:
+            - Keep a scan_name.nessus.manifest file next to the report with the scan result ID, finish time and sha256
+            - The download is skipped and changed is false when the report on disk already holds the latest scan result
+        required: false
+        default: true
+    findings_format:
+        description:
+            - Also write the findings of the report, one record per host/plugin/port, to scan_name.jsonl or scan_name.csv
+            - The report is parsed incrementally, memory use does not depend on the report size
+            - Records hold host, host_ip, plugin_id, plugin_name, severity, port, protocol, svc_name and cves
+        required: false
+        choices: [ jsonl, csv ]
+    findings_db:
+        description:
+            - Path of a SQLite database the findings of every fetched scan result are loaded into, keyed by host, plugin, port and protocol
+            - A scan result already in the database is not parsed again
+            - Once a previous scan result of the same scan is in the database, delta has the number of new, fixed and persisting findings against it
+        required: false
+    delta_limit:
+        description:
+            - Also list the delta_limit most severe new and fixed findings in delta, 0 only returns the counts
+            - The complete lists stay in findings_db, see the findings table
+        required: false
+        default: 0
+    since:
+        description:
+            - Only look at scan results created within this time window, e.g. 12h, 7d or 2w (days when no unit is given)
+            - The window grows while a scan_name is not found, the full history is only listed once it goes over a year
+            - Without it the whole scan result history is listed
+        required: false
+    wait:
+        description:
+            - Wait for running scans to finish instead of failing, polling only their status within the same session
+        required: false
+        default: false
+    wait_timeout:
+        description:
+            - Seconds to wait for a scan to finish before failing
+        required: false
+        default: 3600
+    poll_interval:
+        description:
+            - Seconds between the first status polls, growing by half on every poll up to max_poll_interval
+        required: false
+        default: 10
+    max_poll_interval:
+        description:
+            - Maximum seconds between two status polls
+        required: false
+        default: 300
     server:
         description:
             - Nessus.sc server name
         required: true
+    port:
+        description:
+            - Nessus.sc HTTPS port
+        required: false
+        default: 443
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to Nessus.sc
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for Nessus.sc to answer a call
+        required: false
+        default: 300
+    max_retries:
+        description:
+            - Retries of calls answered 429 or 5xx or whose connection failed, with jittered exponential backoff honouring Retry-After
+            - Creations and launches are only retried when Nessus.sc did not process them (connection failed or 429 answer)
+        required: false
+        default: 5
+    retry_backoff:
+        description:
+            - Seconds before the first retry, doubled on every retry
+        required: false
+        default: 1.0
+    pool_size:
+        description:
+            - Connections to Nessus.sc kept alive and reused between calls
+        required: false
+        default: 10
     username:
         description:
             - username with perms to fetch the scan results from the Nessus.sc server
@@ -36,6 +138,32 @@ options:
         description:
             - username password
         required: true
+    session_cache:
+        description:
+            - Reuse the Nessus.sc session between module runs instead of logging in every time
+            - The session token is stored in a file only readable by the user running the module
+        required: false
+        default: true
+    cache_dir:
+        description:
+            - Folder holding the session cache files
+        required: false
+        default: ~/.ansible/nessus_sc
+    cache_ttl:
+        description:
+            - Seconds the name to ID lookups (scans, policies, assets and credentials) are cached in cache_dir, scan results are always listed again
+            - 0 disables the cache and lists the objects on every run
+        required: false
+        default: 300
+    metrics:
+        description:
+            - Return per API endpoint call counts, latency, bytes transferred and retries under metrics, with wall, API and sleep time totals
+        required: false
+        default: true
+    trace_file:
+        description:
+            - Append every Nessus.sc API call (endpoint, status, latency, bytes, retries) to this file as a JSON line
+        required: false
 notes:
 requirements:
     - Requires the following module to be installed pyTenable
@@ -50,6 +178,45 @@ EXAMPLES = '''
       username: api_nessus
       password: **********
   register: output
+
+- name: Fetch all the weekly Nessus.sc scan results
+  nessus-scan-results
+      scan_pattern: "^Weekly"
+      workers: 8
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
+
+- name: Wait for a Nessus.sc scan to finish and fetch its results
+  nessus-scan-results
+      scan_name: "DMZ Servers"
+      wait: true
+      wait_timeout: 28800
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
+
+- name: Fetch the latest DMZ scan result and compare it with the previous one
+  nessus-scan-results
+      scan_name: "DMZ Servers"
+      findings_db: /var/lib/nessus/findings.db
+      delta_limit: 50
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
+
+- name: Fetch the scan result started by nessus-launch-scan
+  nessus-scan-results
+      scan_name: "DMZ Servers"
+      instance_id: "{{ launch.instance_id }}"
+      wait: true
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
 '''
 
 RETURN = '''
@@ -59,32 +226,62 @@ changed:
 output:
     description: Nessus scan results location path
     type: JSON
+scan_id:
+    description: Scan result ID the report was exported from (single scan_name)
+    type: int
+sha256:
+    description: sha256 of the report (single scan_name)
+    type: str
+findings:
+    description: Path of the findings file written when findings_format is set (single scan_name)
+    type: str
+findings_stored:
+    description: Number of findings of the scan result in findings_db (single scan_name)
+    type: int
+delta:
+    description:
+        - With findings_db, once a previous scan result of the same scan was loaded (single scan_name)
+        - previous_id, new, fixed and persisting counts
+        - With delta_limit, new_findings and fixed_findings list the most severe ones (host, host_ip, plugin_id, plugin_name, severity, port, protocol)
+    type: dict
+scans:
+    description: Per scan name result when scan_names or scan_pattern are used, with the report path (output), scan result ID, sha256, changed and the findings_db delta, or the error
+    type: dict
+http_retries:
+    description: Number of Nessus.sc calls retried by the HTTP transport
+    type: int
+metrics:
+    description: With metrics, wall_time, api_time, sleep_time, calls, errors, retries and bytes totals plus the same per endpoint (METHOD path)
+    type: dict
 '''
 
 
-import zipfile
-import os
 import re
-from ansible.module_utils.basic import AnsibleModule
-import time
-import json
 
+from ansible.module_utils.basic import AnsibleModule
 
-try:
-    from tenable.sc import TenableSC
-    HAS_PYTENABLE = True
-except ImportError:
-    HAS_PYTENABLE = False
-from tenable.sc import TenableSC
+from ansible.module_utils.nessus_findings import FINDINGS_FORMATS, fetch_report
+from ansible.module_utils.nessus_sc import HAS_PYTENABLE, nessus_sc_argument_spec, sc_connect, sc_name_index, run_concurrently, wait_for_scan_result, parse_since, find_scan_results
 
 def run_module():
 
     module_args = dict(
-        scan_name=dict(type='str', required=True),
-        server=dict(type='str', required=True),
-        nessus_username=dict(type='str', required=True),
-        nessus_password=dict(type='str', required=True)
+        scan_name=dict(type='str', required=False),
+        scan_names=dict(type='list', required=False),
+        scan_pattern=dict(type='str', required=False),
+        instance_id=dict(type='int', required=False),
+        workers=dict(type='int', required=False, default=4),
+        incremental=dict(type='bool', required=False, default=True),
+        findings_format=dict(type='str', required=False, choices=FINDINGS_FORMATS),
+        findings_db=dict(type='path', required=False),
+        delta_limit=dict(type='int', required=False, default=0),
+        since=dict(type='str', required=False),
+        wait=dict(type='bool', required=False, default=False),
+        wait_timeout=dict(type='int', required=False, default=3600),
+        poll_interval=dict(type='int', required=False, default=10),
+        max_poll_interval=dict(type='int', required=False, default=300)
         )
+    module_args.update(nessus_sc_argument_spec())
 
     result = dict(
         changed=False,
@@ -94,6 +291,8 @@ def run_module():
 
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[['scan_name', 'scan_names', 'scan_pattern', 'instance_id']],
+        mutually_exclusive=[['instance_id', 'scan_names'], ['instance_id', 'scan_pattern']],
         supports_check_mode=True
     )
 
@@ -101,59 +300,108 @@ def run_module():
         module.fail_json(msg = 'pyTenable required. pip install pytenable')
 
     if module.check_mode:
-        return result
+        module.exit_json(**result)
 
 
     scan_name = module.params['scan_name']
-    server = module.params['server']
-    nessus_username = module.params['nessus_username']
-    nessus_password = module.params['nessus_password']
-
+    scan_names = module.params['scan_names']
+    scan_pattern = module.params['scan_pattern']
+    instance_id = module.params['instance_id']
+    workers = module.params['workers']
+    incremental = module.params['incremental']
+    findings_format = module.params['findings_format']
+    findings_db = module.params['findings_db']
+    wait = module.params['wait']
 
     try:
-        sc = TenableSC(server)
-        sc.login(nessus_username, nessus_password)
-    except:
-        module.fail_json(msg='Issues connectin to Nessus.sc. Please check connectivity and credetials')
-
-
-
-    scan_list = sc.scan_instances.list(start_time=1)['usable']
-    temp_scan_id = [item for item in scan_list if item["name"] == scan_name]
-
-    if temp_scan_id:
-        scan_id = int(temp_scan_id[-1]['id'])
-    else:
-        scan_id = None
-
-    # check scan is COMPLETED and not in PARTIAL or RUNNING state
-    scan_status = sc.scan_instances.details(scan_id)['status']
-    if scan_status.lower() != 'completed':
-      module.fail_json(msg='Nesuss scan has not been COMPLETED. Scan status: ' + str(scan_status))
+        since = parse_since(module.params['since'])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
 
     try:
-      report_name =  re.sub('[\s+]','_',scan_name+'_report.zip')
-      p = open(report_name,'wb')
-      sc.scan_instances.export_scan(scan_id, p)
-      time.sleep(2)
-      p.close()
-
-      time.sleep(2)
-      with zipfile.ZipFile(report_name, 'r') as zip_ref:
-          zip_ref.extract(str(scan_id) + '.nessus','./')
-      time.sleep(2)
-    except:
-      module.fail_json(msg='Issues fetching or extracting the Nessus scan results')
-
-
-    # cleaning up the temp files and renaming
-
-    os.rename( str(scan_id) + '.nessus', scan_name + '.nessus')
-    os.remove(report_name)
-
-
-    result['changed'] = True
-    result['output'] = scan_name + '.nessus'
+        pattern = re.compile(scan_pattern) if scan_pattern else None
+    except re.error as e:
+        module.fail_json(msg='Invalid scan_pattern [' + scan_pattern + ']: ' + str(e))
+
+
+    def fetch(name, scan_id):
+        if wait:
+            wait_for_scan_result(sc, scan_id, module.params['wait_timeout'],
+                                 module.params['poll_interval'], module.params['max_poll_interval'])
+        return fetch_report(sc, scan_id, name, None, incremental, findings_format, findings_db,
+                            module.params['delta_limit'])
+
+
+    sc = sc_connect(module)
+    index = sc_name_index(module, sc)
+
+
+    if instance_id is not None or scan_name and not (scan_names or scan_pattern):
+        if instance_id is not None:
+            scan_id = instance_id
+            if not scan_name:
+                try:
+                    scan_name = sc.scan_instances.details(scan_id, fields=['id', 'name'])['name']
+                except Exception as e:
+                    module.fail_json(msg='Nessus.sc scan results not found: [' + str(scan_id) + ']: ' + str(e))
+        elif since:
+            scan_id = find_scan_results(sc, since, names=[scan_name]).get(scan_name)
+        else:
+            scan_id = index.latest('scan_instances', scan_name)
+        if scan_id is None:
+            module.fail_json(msg='Nessus.sc scan results not found: [' + scan_name + ']')
+
+        try:
+            report = fetch(scan_name, scan_id)
+        except Exception as e:
+            module.fail_json(msg='Issues fetching or extracting the Nessus scan results: ' + str(e))
+
+        result['changed'] = report['changed']
+        result['output'] = report['output']
+        result['scan_id'] = report['scan_id']
+        result['sha256'] = report['sha256']
+        for key in ('findings', 'findings_stored', 'delta'):
+            if key in report:
+                result[key] = report[key]
+        module.exit_json(**result)
+
+
+    # every name is resolved from the same scan results listing
+    names = [name for name in [scan_name] + (scan_names or []) if name]
+    if since:
+        scan_ids = find_scan_results(sc, since, names=names, pattern=pattern)
+        if pattern:
+            names.extend(sorted(name for name in scan_ids if pattern.search(name)))
+    elif pattern:
+        names.extend(sorted(name for name in index.names('scan_instances') if pattern.search(name)))
+    names = sorted(set(names), key=names.index)
+
+    scans = {}
+    jobs = []
+    for name in names:
+        if since:
+            scan_id = scan_ids.get(name)
+        else:
+            scan_id = index.latest('scan_instances', name)
+        if scan_id is None:
+            scans[name] = dict(error='Nessus.sc scan results not found: [' + name + ']')
+        else:
+            jobs.append((name, scan_id))
+
+    for (name, scan_id), report, error in run_concurrently(
+            lambda job: fetch(*job), jobs, workers):
+        if error:
+            scans[name] = dict(scan_id=scan_id, error=error)
+        else:
+            scans[name] = report
+            result['changed'] = result['changed'] or report['changed']
+
+    result['scans'] = scans
+    result['output'] = [scans[name]['output'] for name in names if 'output' in scans[name]]
+
+    failed = [name for name in names if 'error' in scans[name]]
+    if failed:
+        module.fail_json(msg='Issues fetching the Nessus scan results of: [' + ', '.join(failed) + ']', **result)
 
     module.exit_json(**result)
 
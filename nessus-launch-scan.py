@@ -21,11 +21,81 @@ options:
     scan_name:
         description:
             - Nessus.sc scan name
-        required: true
+            - One of scan_name or scan_names is required
+        required: false
+    scan_names:
+        description:
+            - List of Nessus.sc scans launched in order, keeping at most max_concurrent of them running
+            - The module waits until every scan has finished so it can start the next queued one as soon as a slot frees up
+            - Scans that already have scan results are skipped
+        required: false
+    max_concurrent:
+        description:
+            - Maximum number of scans of scan_names running at the same time
+        required: false
+        default: 4
+    wait:
+        description:
+            - Wait for the scan_name scan result to reach a terminal status and return its timing and progress
+        required: false
+        default: false
+    wait_timeout:
+        description:
+            - Seconds to wait before giving up
+            - With scan_names the scans still queued are then reported and not launched
+        required: false
+        default: 86400
+    poll_interval:
+        description:
+            - Seconds between the first status polls, growing by half on every poll up to max_poll_interval (with scan_names, on every poll where no scan finished)
+        required: false
+        default: 10
+    max_poll_interval:
+        description:
+            - Maximum seconds between two status polls
+        required: false
+        default: 60
+    since:
+        description:
+            - Only look at scan results created within this time window, e.g. 12h, 7d or 2w (days when no unit is given)
+            - A scan with results in that window is not launched again
+            - Without it the whole scan result history is listed
+        required: false
     server:
         description:
             - Nessus.sc server name
         required: true
+    port:
+        description:
+            - Nessus.sc HTTPS port
+        required: false
+        default: 443
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to Nessus.sc
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for Nessus.sc to answer a call
+        required: false
+        default: 300
+    max_retries:
+        description:
+            - Retries of calls answered 429 or 5xx or whose connection failed, with jittered exponential backoff honouring Retry-After
+            - Creations and launches are only retried when Nessus.sc did not process them (connection failed or 429 answer)
+        required: false
+        default: 5
+    retry_backoff:
+        description:
+            - Seconds before the first retry, doubled on every retry
+        required: false
+        default: 1.0
+    pool_size:
+        description:
+            - Connections to Nessus.sc kept alive and reused between calls
+        required: false
+        default: 10
     username:
         description:
             - user with perms launch scans in Nessus.sc server
@@ -34,6 +104,32 @@ options:
         description:
             - user's password
         required: true
+    session_cache:
+        description:
+            - Reuse the Nessus.sc session between module runs instead of logging in every time
+            - The session token is stored in a file only readable by the user running the module
+        required: false
+        default: true
+    cache_dir:
+        description:
+            - Folder holding the session cache files
+        required: false
+        default: ~/.ansible/nessus_sc
+    cache_ttl:
+        description:
+            - Seconds the name to ID lookups (scans, policies, assets and credentials) are cached in cache_dir, scan results are always listed again
+            - 0 disables the cache and lists the objects on every run
+        required: false
+        default: 300
+    metrics:
+        description:
+            - Return per API endpoint call counts, latency, bytes transferred and retries under metrics, with wall, API and sleep time totals
+        required: false
+        default: true
+    trace_file:
+        description:
+            - Append every Nessus.sc API call (endpoint, status, latency, bytes, retries) to this file as a JSON line
+        required: false
 notes:
 requirements:
     - Requires the following module to be installed pyTenable
@@ -48,6 +144,26 @@ EXAMPLES = '''
       username: api_nessus
       password: *****
   register: output
+
+- name: Run Nessus.sc scan and wait for it to finish
+  nessus-launch-scan
+      scan_name: "Internal Windows Workstations"
+      wait: true
+      wait_timeout: 28800
+      server: nesuss.sc_server
+      username: api_nessus
+      password: *****
+  register: output
+
+- name: Run the weekly scans, 5 at a time
+  nessus-launch-scan
+      scan_names: "{{ weekly_scans }}"
+      max_concurrent: 5
+      wait_timeout: 43200
+      server: nesuss.sc_server
+      username: api_nessus
+      password: *****
+  register: output
 '''
 
 RETURN = '''
@@ -57,30 +173,47 @@ changed:
 output:
     description: Scan name and ID in Nessus.sc
     type: JSON
+instance_id:
+    description: ID of the scan result (scan instance) started by scan_name, can be passed to nessus-fetch-scan instance_id
+    type: int
+progress:
+    description:
+        - With wait, status, total_ips, scanned_ips, completed_ips, queue_time and run_time (seconds), hosts_per_minute and polls
+        - samples lists the elapsed seconds, status and completed_ips every time the status or completed_ips changed
+    type: dict
+scans:
+    description:
+        - With scan_names, per scan name state (launched, exists, failed or queued), scan_id, instance_id and last status
+        - launched and finished are the seconds since the module started when the scan was launched and seen finished
+    type: dict
+http_retries:
+    description: Number of Nessus.sc calls retried by the HTTP transport
+    type: int
+metrics:
+    description: With metrics, wall_time, api_time, sleep_time, calls, errors, retries and bytes totals plus the same per endpoint (METHOD path)
+    type: dict
 '''
 
 
-import os
 from ansible.module_utils.basic import AnsibleModule
-import time
-import json
-
 
-try:
-    from tenable.sc import TenableSC
-    HAS_PYTENABLE = True
-except ImportError:
-    HAS_PYTENABLE = False
+from ansible.module_utils.nessus_sc import HAS_PYTENABLE, nessus_sc_argument_spec, sc_connect, sc_name_index, parse_since, find_scan_results, wait_for_scan_result, ScanWaitTimeout
+from ansible.module_utils.nessus_scans import PROGRESS_FIELDS, LaunchQueueError, ScanProgress, launch_queue, launch_named_scan
 
 
 def run_module():
 
     module_args = dict(
-        scan_name=dict(type='str', required=True),
-        server=dict(type='str', required=True),
-        nessus_username=dict(type='str', required=True),
-        nessus_password=dict(type='str', required=True)
+        scan_name=dict(type='str', required=False),
+        scan_names=dict(type='list', required=False),
+        since=dict(type='str', required=False),
+        max_concurrent=dict(type='int', required=False, default=4),
+        wait=dict(type='bool', required=False, default=False),
+        wait_timeout=dict(type='int', required=False, default=86400),
+        poll_interval=dict(type='int', required=False, default=10),
+        max_poll_interval=dict(type='int', required=False, default=60)
         )
+    module_args.update(nessus_sc_argument_spec())
 
     result = dict(
         changed=False,
@@ -90,6 +223,8 @@ def run_module():
 
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[['scan_name', 'scan_names']],
+        mutually_exclusive=[['scan_name', 'scan_names']],
         supports_check_mode=True
     )
 
@@ -101,39 +236,98 @@ def run_module():
 
 
     scan_name = module.params['scan_name']
-    server = module.params['server']
-    nessus_username = module.params['nessus_username']
-    nessus_password = module.params['nessus_password']
-
-    nessus_credentials_list = []
+    scan_names = module.params['scan_names']
 
     try:
-        sc = TenableSC(server)
-        sc.login(nessus_username, nessus_password)
-    except:
-        module.fail_json(msg='Issues connectin to Nessus.sc. Please check connectivity and credetials')
+        since = parse_since(module.params['since'])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+    sc = sc_connect(module)
+    index = sc_name_index(module, sc)
+
+
+    if scan_names:
+        # scan results of every name from the same listing
+        if since:
+            scan_results = find_scan_results(sc, since, names=scan_names, expand=False)
+        else:
+            scan_results = dict((name, True) for name in scan_names if index.ids('scan_instances', name))
+
+        scans = {}
+        queue = []
+        for name in sorted(set(scan_names), key=scan_names.index):
+            scan_id = index.get('scans', name)
+            if scan_id is None:
+                scans[name] = dict(state='failed', error='Nessus scan not found: [' + name + ']')
+            elif name in scan_results:
+                scans[name] = dict(state='exists', scan_id=scan_id)
+            else:
+                queue.append((name, scan_id))
+
+        try:
+            scans.update(launch_queue(sc, index, queue, max(1, module.params['max_concurrent']),
+                                      module.params['wait_timeout'], module.params['poll_interval'],
+                                      module.params['max_poll_interval'], log=module.log))
+        except LaunchQueueError as e:
+            # scans already launched keep running, report their scan result IDs
+            scans.update(e.statuses)
+            result['scans'] = scans
+            result['changed'] = any(status['state'] == 'launched' for status in scans.values())
+            module.fail_json(msg=str(e), **result)
+
+        result['scans'] = scans
+        result['changed'] = any(status['state'] == 'launched' for status in scans.values())
+        result['output'] = 'Nessus.sc Scans launched: [' + ', '.join(
+            name for name in scan_names if scans[name]['state'] == 'launched') + ']'
+
+        failed = [name for name in scan_names if scans[name]['state'] == 'failed']
+        if failed:
+            module.fail_json(msg='Issues launching the Nessus.sc scans: [' + ', '.join(failed) + ']', **result)
+        queued = [name for name in scan_names if scans[name]['state'] == 'queued']
+        if queued:
+            module.fail_json(msg='Nessus.sc scans not launched within wait_timeout: [' + ', '.join(queued) + ']', **result)
+        module.exit_json(**result)
 
 
     # listing scans
-    scan_list = sc.scans.list()['usable']
-    scan_id = [item for item in scan_list if item["name"] == scan_name]
-    if scan_id:
-        nessus_scan_id = int(scan_id[0]['id'])
-    else:
+    nessus_scan_id = index.get('scans', scan_name)
+    if nessus_scan_id is None:
         module.fail_json(msg="Nessus scan not found: [" + scan_name + "]")
 
     # listing scan_instances (scan results TAB in Nessus.sc)
-    scan_instances_list = sc.scan_instances.list(start_time=1)['usable']
-    scan_instances_id = [item for item in scan_instances_list if item["name"] == scan_name]
-    if scan_instances_id:
+    if since:
+        scan_results = find_scan_results(sc, since, names=[scan_name], expand=False)
+    else:
+        scan_results = index.ids('scan_instances', scan_name)
+    if scan_results:
         module.fail_json(msg='Nessus.sc scan results already exists: [' + scan_name + ']')
     else:
-        sc.scans.launch(nessus_scan_id)
+        try:
+            instance_id = launch_named_scan(sc, index, scan_name)[1]
+        except Exception as e:
+            module.fail_json(msg='Issues launching the Nessus.sc scan [' + scan_name + ']: ' + str(e))
 
 
     result['changed'] = True
+    result['instance_id'] = instance_id
     result['output'] = 'Nessus.sc Scan Name: [' + scan_name + ']'
 
+    if module.params['wait']:
+        progress = ScanProgress()
+        try:
+            wait_for_scan_result(sc, instance_id, module.params['wait_timeout'], module.params['poll_interval'],
+                                 module.params['max_poll_interval'], PROGRESS_FIELDS, progress.on_poll)
+        except ScanWaitTimeout as e:
+            result['progress'] = progress.summary()
+            module.fail_json(msg=str(e), **result)
+        except Exception as e:
+            # the scan keeps running, instance_id lets a later task wait for or fetch it
+            result['progress'] = progress.summary()
+            module.fail_json(msg='Issues polling the Nessus.sc scan result ' + str(instance_id) + ': ' + str(e),
+                             **result)
+        result['progress'] = progress.summary()
+
     module.exit_json(**result)
 
 
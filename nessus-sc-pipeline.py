@@ -0,0 +1,525 @@
+#!/usr/bin/python
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: Nessus.sc scan pipeline
+short_description: Build assets, create, launch, wait for and fetch a Nessus.sc scan in one task
+description:
+    - Runs the steps of nessus-create-assets, nessus-create-scan, nessus-launch-scan and nessus-fetch-scan in a single process
+    - A single Nessus.sc session and a single listing of every object type are shared by all the stages
+    - Objects that already exist are reused, so the pipeline can be run again after a failure
+    - The scan result launched is recorded in dest.launch until the fetch stage downloads it, a run started again reuses it instead of launching the scan a second time
+version_added: "2.4"
+author: Jesus Rodriguez Fonteboa (@hiperesfera)
+options:
+    stages:
+        description:
+            - Stages to run, always in the order assets, create, launch, wait, fetch
+        required: false
+        default: [ assets, create, launch, wait, fetch ]
+        choices: [ assets, create, launch, wait, fetch ]
+    asset_name:
+        description:
+            - Nessus.sc asset list built by the assets stage from file_location, and scanned by the create stage
+            - Required with the assets stage
+        required: false
+    asset_type:
+        description:
+            - Nessus.sc asset type: DNS or IP
+            - Required with the assets stage
+        required: false
+    file_location:
+        description:
+            - CSV file with an ip or hostname column
+            - Required with the assets stage
+        required: false
+    asset_targets:
+        description:
+            - Regex expression, only the CSV values matching it are added to the asset list
+        required: false
+        default: .*
+    csv_engine:
+        description:
+            - stream reads the CSV file one row at a time, pandas loads it whole with pandas
+        required: false
+        default: stream
+        choices: [ stream, pandas ]
+    update_mode:
+        description:
+            - delta edits an existing asset list in place, recreate deletes and creates it again
+        required: false
+        default: delta
+        choices: [ delta, recreate ]
+    aggregate_ips:
+        description:
+            - Merge contiguous ips into CIDR ranges
+        required: false
+        default: true
+    chunk_size:
+        description:
+            - Split asset lists over this number of entries into several lists, 0 disables it
+        required: false
+        default: 0
+    chunk_mode:
+        description:
+            - combine ORs the chunks in a combination asset list called asset_name, shard only creates the chunks
+        required: false
+        default: combine
+        choices: [ combine, shard ]
+    chunk_retries:
+        description:
+            - Retries of every chunk
+        required: false
+        default: 3
+    scan_name:
+        description:
+            - Nessus.sc scan name
+        required: true
+    policy_name:
+        description:
+            - Nessus.sc policy name
+            - Required with the create stage
+        required: false
+    targets:
+        description:
+            - Targets/remote servers to scan, on top of asset_name
+        required: false
+    assets:
+        description:
+            - Other asset lists to scan, on top of asset_name
+        required: false
+    credentials:
+        description:
+            - Optional credetials for authenticated scan
+        required: false
+    since:
+        description:
+            - The launch stage reuses the newest scan result created within this time window, e.g. 12h or 7d, instead of launching the scan again
+            - Without it, the scan is only launched again once the fetch stage downloaded the previous launch (or when that scan result failed or was deleted)
+        required: false
+    wait_timeout:
+        description:
+            - Seconds the wait stage waits for the scan to finish
+        required: false
+        default: 86400
+    poll_interval:
+        description:
+            - Seconds between the first status polls, growing by half on every poll up to max_poll_interval
+        required: false
+        default: 10
+    max_poll_interval:
+        description:
+            - Maximum seconds between two status polls
+        required: false
+        default: 300
+    instance_id:
+        description:
+            - Scan result waited for and fetched; the launch stage is skipped when it is set
+            - The newest scan result of scan_name when neither it nor the launch stage are given
+        required: false
+    dest:
+        description:
+            - Report file written by the fetch stage
+            - dest.launch records the scan result launched until it is fetched
+        required: false
+        default: scan_name.nessus
+    incremental:
+        description:
+            - Skip the download when dest already holds the scan result, see nessus-fetch-scan
+        required: false
+        default: true
+    findings_format:
+        description:
+            - Also write the findings of the report as JSON lines or CSV, see nessus-fetch-scan
+        required: false
+        choices: [ jsonl, csv ]
+    findings_db:
+        description:
+            - Also load the findings of the report into this SQLite database and return the delta against the previous scan result, see nessus-fetch-scan
+        required: false
+    delta_limit:
+        description:
+            - Most severe new and fixed findings listed in delta, 0 only returns the counts
+        required: false
+        default: 0
+    workers:
+        description:
+            - Maximum number of asset list chunks synced at the same time
+        required: false
+        default: 4
+    server:
+        description:
+            - Nessus.sc server name
+        required: true
+    port:
+        description:
+            - Nessus.sc HTTPS port
+        required: false
+        default: 443
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to Nessus.sc
+        required: false
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for Nessus.sc to answer a call
+        required: false
+        default: 300
+    max_retries:
+        description:
+            - Retries of calls answered 429 or 5xx or whose connection failed, with jittered exponential backoff honouring Retry-After
+            - Creations and launches are only retried when Nessus.sc did not process them (connection failed or 429 answer)
+        required: false
+        default: 5
+    retry_backoff:
+        description:
+            - Seconds before the first retry, doubled on every retry
+        required: false
+        default: 1.0
+    pool_size:
+        description:
+            - Connections to Nessus.sc kept alive and reused between calls
+        required: false
+        default: 10
+    username:
+        description:
+            - user with perms to create assets and scans, launch scans and fetch their results from the Nessus.sc server
+        required: true
+    password:
+        description:
+            - username password
+        required: true
+    session_cache:
+        description:
+            - Reuse the Nessus.sc session between module runs instead of logging in every time
+            - The session token is stored in a file only readable by the user running the module
+        required: false
+        default: true
+    cache_dir:
+        description:
+            - Folder holding the session cache files
+        required: false
+        default: ~/.ansible/nessus_sc
+    cache_ttl:
+        description:
+            - Seconds the name to ID lookups (scans, policies, assets and credentials) are cached in cache_dir, scan results are always listed again
+            - 0 disables the cache and lists the objects on every run
+        required: false
+        default: 300
+    metrics:
+        description:
+            - Return per API endpoint call counts, latency, bytes transferred and retries under metrics, with wall, API and sleep time totals
+        required: false
+        default: true
+    trace_file:
+        description:
+            - Append every Nessus.sc API call (endpoint, status, latency, bytes, retries) to this file as a JSON line
+        required: false
+notes:
+requirements:
+    - Requires the following module to be installed pyTenable
+    - Tested with Ansible 2.8.6 version and Python 2.7.16
+'''
+
+EXAMPLES = '''
+- name: Scan the DMZ servers listed in the CMDB export and fetch the report
+  nessus-sc-pipeline
+      asset_name: "DMZ servers"
+      asset_type: ip
+      file_location: /tmp/cmdb.csv
+      scan_name: "DMZ Servers"
+      policy_name: "Nessus Policy Linux Servers"
+      credentials:
+         - dmz_nessus_user
+      findings_format: jsonl
+      wait_timeout: 28800
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
+
+- name: Fetch the report of a scan launched by an earlier run
+  nessus-sc-pipeline
+      stages: [ wait, fetch ]
+      scan_name: "DMZ Servers"
+      server: Nessus.sc server
+      username: api_nessus
+      password: **********
+  register: output
+'''
+
+RETURN = '''
+changed:
+    description: If any stage changed something in Nessus.sc or on disk
+    type: bool
+stages:
+    description:
+        - Result of every stage run
+        - assets has asset_id, added and removed, create has state (created or exists) and scan_id
+        - launch has instance_id, launched and reused (pending launch, since or instance_id), wait has the progress of nessus-launch-scan, fetch has output, sha256, findings and, with findings_db, findings_stored and delta
+    type: dict
+timings:
+    description: Seconds spent connecting and in every stage, and in total
+    type: dict
+output:
+    description: Report file written by the fetch stage
+    type: str
+http_retries:
+    description: Number of Nessus.sc calls retried by the HTTP transport
+    type: int
+metrics:
+    description: With metrics, wall_time, api_time, sleep_time, calls, errors, retries and bytes totals plus the same per endpoint (METHOD path)
+    type: dict
+'''
+
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+
+from ansible.module_utils.nessus_assets import ASSET_COLUMNS, CSV_ENGINES, UPDATE_MODES, CHUNK_MODES, load_hosts, build_asset_list
+from ansible.module_utils.nessus_export import read_launch_record, write_launch_record, clear_launch_record
+from ansible.module_utils.nessus_findings import FINDINGS_FORMATS, fetch_report
+from ansible.module_utils.nessus_sc import TERMINAL_SCAN_STATUS, HAS_PYTENABLE, nessus_sc_argument_spec, sc_connect, sc_name_index, parse_since, find_scan_results, wait_for_scan_result
+from ansible.module_utils.nessus_scans import PROGRESS_FIELDS, ScanProgress, create_scan, launch_named_scan, resolve_scan_definition
+
+
+STAGES = ['assets', 'create', 'launch', 'wait', 'fetch']
+
+
+def run_module():
+
+    module_args = dict(
+        stages=dict(type='list', required=False, default=STAGES, choices=STAGES),
+        asset_name=dict(type='str', required=False),
+        asset_type=dict(type='str', required=False),
+        file_location=dict(type='str', required=False),
+        asset_targets=dict(type='str', required=False, default='.*'),
+        csv_engine=dict(type='str', required=False, default='stream', choices=CSV_ENGINES),
+        update_mode=dict(type='str', required=False, default='delta', choices=UPDATE_MODES),
+        aggregate_ips=dict(type='bool', required=False, default=True),
+        chunk_size=dict(type='int', required=False, default=0),
+        chunk_mode=dict(type='str', required=False, default='combine', choices=CHUNK_MODES),
+        chunk_retries=dict(type='int', required=False, default=3),
+        scan_name=dict(type='str', required=True),
+        policy_name=dict(type='str', required=False),
+        targets=dict(type='list', required=False),
+        assets=dict(type='list', required=False),
+        credentials=dict(type='list', required=False),
+        since=dict(type='str', required=False),
+        wait_timeout=dict(type='int', required=False, default=86400),
+        poll_interval=dict(type='int', required=False, default=10),
+        max_poll_interval=dict(type='int', required=False, default=300),
+        instance_id=dict(type='int', required=False),
+        dest=dict(type='str', required=False),
+        incremental=dict(type='bool', required=False, default=True),
+        findings_format=dict(type='str', required=False, choices=FINDINGS_FORMATS),
+        findings_db=dict(type='path', required=False),
+        delta_limit=dict(type='int', required=False, default=0),
+        workers=dict(type='int', required=False, default=4)
+        )
+    module_args.update(nessus_sc_argument_spec())
+
+    result = dict(
+        changed=False,
+        original_message='',
+        message='',
+        stages={},
+        timings={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    if not HAS_PYTENABLE:
+        module.fail_json(msg = 'pyTenable required. pip install pytenable')
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+
+    stages = module.params['stages']
+    scan_name = module.params['scan_name']
+    asset_name = module.params['asset_name']
+    dest = module.params['dest'] or scan_name + '.nessus'
+    stage_results = result['stages']
+    timings = result['timings']
+    started = time.time()
+
+    if 'assets' in stages:
+        missing = [key for key in ('asset_name', 'asset_type', 'file_location') if not module.params[key]]
+        if missing:
+            module.fail_json(msg='The assets stage needs: ' + ', '.join(missing))
+        column = ASSET_COLUMNS.get(module.params['asset_type'].lower())
+        if column is None:
+            module.fail_json(msg='Nessus.sc asset type must be DNS or IP: [' + module.params['asset_type'] + ']')
+    if 'create' in stages and not module.params['policy_name']:
+        module.fail_json(msg='The create stage needs policy_name')
+
+    try:
+        since = parse_since(module.params['since'])
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+
+    def stage_failed(stage, msg):
+        timings[stage] = round(time.time() - stage_started, 3)
+        timings['total'] = round(time.time() - started, 3)
+        module.fail_json(msg='Nessus.sc pipeline ' + stage + ' stage: ' + msg, **result)
+
+    def stage_done(stage, stage_result):
+        stage_results[stage] = stage_result
+        timings[stage] = round(time.time() - stage_started, 3)
+        if stage_result.get('changed'):
+            result['changed'] = True
+
+
+    # the CSV file is read before connecting, as nessus-create-assets does
+    if 'assets' in stages:
+        stage_started = time.time()
+        file_location = module.params['file_location']
+        try:
+            host_list, invalid = load_hosts(file_location, column, module.params['asset_targets'],
+                                            module.params['csv_engine'], module.params['aggregate_ips'])
+        except ImportError:
+            module.fail_json(msg = 'Pandas required. pip install panda')
+        except Exception as e:
+            module.fail_json(msg='Issues loading CSV file ' + file_location + ': ' + str(e))
+        if invalid:
+            result['invalid'] = invalid
+            module.warn('Dropped ' + str(len(invalid)) + ' invalid ip values from ' + file_location)
+        timings['csv'] = round(time.time() - stage_started, 3)
+
+    stage_started = time.time()
+    sc = sc_connect(module)
+    index = sc_name_index(module, sc)
+    timings['connect'] = round(time.time() - stage_started, 3)
+
+
+    if 'assets' in stages:
+        stage_started = time.time()
+        try:
+            asset = build_asset_list(sc, index, asset_name, column, host_list, module.params['update_mode'],
+                                     module.params['chunk_size'], module.params['chunk_mode'],
+                                     module.params['chunk_retries'], module.params['workers'], module.log)
+        except Exception as e:
+            stage_failed('assets', str(e))
+        stage_done('assets', asset)
+
+
+    scan_id = None
+    if 'create' in stages:
+        stage_started = time.time()
+        definition = dict(scan_name=scan_name, policy_name=module.params['policy_name'],
+                          targets=module.params['targets'], credentials=module.params['credentials'],
+                          assets=([asset_name] if asset_name else []) + (module.params['assets'] or []))
+        scan_id = index.get('scans', scan_name)
+        if scan_id is not None:
+            stage_done('create', dict(changed=False, state='exists', scan_id=scan_id))
+        else:
+            try:
+                ids = resolve_scan_definition(index, definition)
+                scan_id = create_scan(sc, index, scan_name, ids['policy_id'], definition['targets'],
+                                      ids['asset_ids'], ids['credential_ids'])
+            except Exception as e:
+                stage_failed('create', str(e))
+            stage_done('create', dict(changed=True, state='created', scan_id=scan_id))
+
+
+    def pending_launch():
+        ''' Scan result launched by a previous run and not fetched yet, unless it failed or is gone '''
+        record = read_launch_record(dest)
+        if not record or record.get('scan_name') != scan_name:
+            return None
+        try:
+            status = sc.scan_instances.details(record['instance_id'], fields=['id', 'status'])['status']
+        except Exception:
+            return None
+        status = str(status).lower()
+        if status == 'completed' or status not in TERMINAL_SCAN_STATUS:
+            return int(record['instance_id'])
+        return None
+
+
+    instance_id = module.params['instance_id']
+    if 'launch' in stages:
+        stage_started = time.time()
+        if scan_id is None:
+            scan_id = index.get('scans', scan_name)
+            if scan_id is None:
+                stage_failed('launch', 'Nessus scan not found: [' + scan_name + ']')
+        found = instance_id
+        if found is None and since:
+            found = find_scan_results(sc, since, names=[scan_name], expand=False).get(scan_name)
+        if found is None:
+            found = pending_launch()
+        if found is not None:
+            instance_id = found
+            stage_done('launch', dict(changed=False, launched=False, reused=True, instance_id=instance_id))
+        else:
+            try:
+                scan_id, instance_id = launch_named_scan(sc, index, scan_name)
+            except Exception as e:
+                stage_failed('launch', str(e))
+            try:
+                write_launch_record(dest, dict(scan_name=scan_name, instance_id=instance_id,
+                                               launched=int(time.time())))
+            except (IOError, OSError) as e:
+                module.warn('Could not record the launched scan result in ' + dest + '.launch: ' + str(e))
+            stage_done('launch', dict(changed=True, launched=True, reused=False, instance_id=instance_id))
+
+    if instance_id is None and ('wait' in stages or 'fetch' in stages):
+        instance_id = index.latest('scan_instances', scan_name)
+        if instance_id is None:
+            module.fail_json(msg='Nessus.sc scan results not found: [' + scan_name + ']', **result)
+
+
+    if 'wait' in stages:
+        stage_started = time.time()
+        progress = ScanProgress()
+        try:
+            wait_for_scan_result(sc, instance_id, module.params['wait_timeout'], module.params['poll_interval'],
+                                 module.params['max_poll_interval'], PROGRESS_FIELDS, progress.on_poll)
+        except Exception as e:
+            stage_results['wait'] = progress.summary()
+            stage_failed('wait', str(e))
+        stage_done('wait', progress.summary())
+
+
+    if 'fetch' in stages:
+        stage_started = time.time()
+        try:
+            report = fetch_report(sc, instance_id, scan_name, dest, module.params['incremental'],
+                                  module.params['findings_format'], module.params['findings_db'],
+                                  module.params['delta_limit'])
+        except Exception as e:
+            stage_failed('fetch', 'Issues fetching or extracting the Nessus scan results: ' + str(e))
+        # the next run launches the scan again
+        record = read_launch_record(dest)
+        if record and record.get('instance_id') == instance_id:
+            clear_launch_record(dest)
+        stage_done('fetch', report)
+        result['output'] = report['output']
+
+
+    timings['total'] = round(time.time() - started, 3)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
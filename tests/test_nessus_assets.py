@@ -0,0 +1,74 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Tests of the ip entry parsing and merging of module_utils/nessus_assets.py.
+# The module_utils folder is added to the ansible.module_utils package, the
+# way Ansible ships it to the managed node.
+#
+#   python -m pytest tests
+
+import os
+import unittest
+
+import ansible.module_utils
+
+ansible.module_utils.__path__.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  'module_utils'))
+
+from ansible.module_utils.nessus_assets import merge_ip_ranges, normalize_ips, parse_ip_entry
+
+
+def ip(value):
+    return parse_ip_entry(value)[1]
+
+
+class MergeIpRangesTest(unittest.TestCase):
+
+    def test_overlapping_and_adjacent(self):
+        ranges = [parse_ip_entry('10.0.0.10-10.0.0.20'), parse_ip_entry('10.0.0.15-10.0.0.30'),
+                  parse_ip_entry('10.0.0.31'), parse_ip_entry('10.0.0.40')]
+        self.assertEqual(merge_ip_ranges(ranges), [[4, ip('10.0.0.10'), ip('10.0.0.31')],
+                                                   [4, ip('10.0.0.40'), ip('10.0.0.40')]])
+
+    def test_contained(self):
+        ranges = [parse_ip_entry('10.0.0.0/24'), parse_ip_entry('10.0.0.7'), parse_ip_entry('10.0.0.0/28')]
+        self.assertEqual(merge_ip_ranges(ranges), [[4, ip('10.0.0.0'), ip('10.0.0.255')]])
+
+    def test_versions_kept_apart(self):
+        # the integer of ::a follows the one of 0.0.0.9, they must not be merged
+        ranges = [parse_ip_entry('::a'), parse_ip_entry('0.0.0.9'), parse_ip_entry('::9')]
+        self.assertEqual(merge_ip_ranges(ranges), [[4, 9, 9], [6, 9, 10]])
+
+    def test_empty(self):
+        self.assertEqual(merge_ip_ranges([]), [])
+
+
+class NormalizeIpsTest(unittest.TestCase):
+
+    def test_collapse(self):
+        values = ['10.0.0.%d' % n for n in range(256)] + ['10.0.1.0', '10.0.1.1', '192.168.1.5']
+        self.assertEqual(normalize_ips(values), (['10.0.0.0/24', '10.0.1.0/31', '192.168.1.5'], []))
+
+    def test_ranges_and_cidrs(self):
+        entries, invalid = normalize_ips(['10.0.0.1-10.0.0.6', '10.0.0.8/29', ' 10.0.0.7 '])
+        self.assertEqual(entries, ['10.0.0.1', '10.0.0.2/31', '10.0.0.4/30', '10.0.0.8/29'])
+        self.assertEqual(invalid, [])
+
+    def test_invalid_and_duplicates(self):
+        entries, invalid = normalize_ips(['10.0.0.1', 'host.example.com', '10.0.0.1', '10.0.0.300',
+                                          '10.0.0.9-10.0.0.2'], collapse=False)
+        self.assertEqual(entries, ['10.0.0.1'])
+        self.assertEqual(invalid, ['host.example.com', '10.0.0.300', '10.0.0.9-10.0.0.2'])
+
+    def test_no_collapse_keeps_order(self):
+        entries, invalid = normalize_ips(['10.0.0.2', '10.0.0.1', '10.0.0.2'], collapse=False)
+        self.assertEqual(entries, ['10.0.0.2', '10.0.0.1'])
+
+    def test_ipv6(self):
+        entries, invalid = normalize_ips(['2001:db8::1', '2001:db8::0', '2001:DB8::2-2001:db8::3', '10.0.0.1'])
+        self.assertEqual(entries, ['10.0.0.1', '2001:db8::/126'])
+        self.assertEqual(invalid, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
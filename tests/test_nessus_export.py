@@ -0,0 +1,240 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Tests of the streaming scan export extraction (module_utils/nessus_export.py)
+# fed with zip archives built by zipfile, split into chunks of several sizes.
+#
+#   python -m pytest tests
+
+import io
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+
+from nessus_export import ExportError, ZipMemberWriter, export_scan_to_file
+
+
+CHUNK_SIZES = [1, 7, 1024 * 1024]
+
+
+def report(size):
+    ''' .nessus like payload of about size bytes, compressible but not trivially '''
+    rand = random.Random(size)
+    lines = []
+    total = 0
+    while total < size:
+        line = ('<ReportItem port="%d" pluginID="%d" severity="%d"><cve>CVE-2020-%04d</cve></ReportItem>\n' % (
+            rand.randint(1, 65535), rand.randint(10000, 99999), rand.randint(0, 4), rand.randint(0, 9999)))
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode('utf-8')
+
+
+class Unseekable(object):
+    ''' Write only stream, zipfile then writes data descriptors after every member '''
+
+    def __init__(self):
+        self.buf = io.BytesIO()
+
+    def write(self, data):
+        return self.buf.write(data)
+
+    def flush(self):
+        pass
+
+
+def build_zip(members, compression=zipfile.ZIP_DEFLATED, seekable=True, zip64=False):
+    ''' Zip archive bytes holding the (name, data) members '''
+    stream = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(stream, 'w', compression) as archive:
+        for name, data in members:
+            with archive.open(name, 'w', force_zip64=zip64) as member:
+                member.write(data)
+    return (stream if seekable else stream.buf).getvalue()
+
+
+def extract(data, chunk_size, suffix='.nessus'):
+    out = io.BytesIO()
+    writer = ZipMemberWriter(out, suffix)
+    for pos in range(0, len(data), chunk_size):
+        writer.feed(data[pos:pos + chunk_size])
+    writer.close()
+    return writer, out.getvalue()
+
+
+class ZipMemberWriterTest(unittest.TestCase):
+
+    def check(self, archive, expected, name='123.nessus', chunk_sizes=CHUNK_SIZES):
+        for chunk_size in chunk_sizes:
+            with self.subTest(chunk_size=chunk_size):
+                writer, data = extract(archive, chunk_size)
+                self.assertEqual(data, expected)
+                self.assertEqual(writer.member, name)
+                self.assertEqual(writer.size, len(expected))
+
+    def test_deflated(self):
+        payload = report(200000)
+        self.check(build_zip([('123.nessus', payload)]), payload)
+
+    def test_deflated_larger_than_chunk(self):
+        payload = report(3 * 1024 * 1024)
+        self.check(build_zip([('123.nessus', payload)]), payload, chunk_sizes=[1024 * 1024])
+
+    # the report comes after another member, so its local header is only
+    # found if the descriptor of the first one was read with the right size
+
+    def test_data_descriptor(self):
+        payload = report(200000)
+        archive = build_zip([('readme.txt', report(3000)), ('123.nessus', payload)], seekable=False)
+        self.assertTrue(struct.unpack_from('<H', archive, 6)[0] & 0x08)
+        self.check(archive, payload)
+
+    def test_zip64_data_descriptor(self):
+        payload = report(200000)
+        archive = build_zip([('readme.txt', report(3000)), ('123.nessus', payload)], seekable=False, zip64=True)
+        self.check(archive, payload)
+
+    def test_zip64_stored(self):
+        payload = report(50000)
+        self.check(build_zip([('123.nessus', payload)], zipfile.ZIP_STORED, zip64=True), payload)
+
+    def test_stored(self):
+        payload = report(50000)
+        self.check(build_zip([('123.nessus', payload)], zipfile.ZIP_STORED), payload)
+
+    def test_first_matching_member(self):
+        payload = report(50000)
+        archive = build_zip([('readme.txt', b'not this one'), ('123.nessus', payload),
+                             ('456.nessus', report(1000))])
+        self.check(archive, payload)
+
+    def test_utf8_name(self):
+        payload = report(1000)
+        self.check(build_zip([(u'résultat.nessus', payload)]), payload, name=u'résultat.nessus')
+
+    def test_plain_xml(self):
+        payload = b'<?xml version="1.0" ?>\n<NessusClientData_v2>' + report(20000) + b'</NessusClientData_v2>'
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                writer, data = extract(payload, chunk_size)
+                self.assertEqual(data, payload)
+                self.assertIsNone(writer.member)
+
+    def test_plain_xml_bom_and_whitespace(self):
+        payload = (b'\xef\xbb\xbf \r\n\t<?xml version="1.0" ?>\n<NessusClientData_v2>' + report(1000)
+                   + b'</NessusClientData_v2>')
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                writer, data = extract(payload, chunk_size)
+                self.assertEqual(data, payload)
+
+    def test_not_xml_rejected(self):
+        # errors answered with status 200 instead of the export
+        for body in (b'{"error_code": 146, "error_msg": "Scan result not found"}', b'\xef\xbb\xbf  Not found',
+                     b'  \n' * 5000):
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(body=body[:10], chunk_size=chunk_size):
+                    with self.assertRaisesRegex(ExportError, 'neither a zip archive nor'):
+                        extract(body, chunk_size)
+
+    def test_stored_with_descriptor_rejected(self):
+        archive = build_zip([('123.nessus', report(1000))], zipfile.ZIP_STORED, seekable=False)
+        # the size of the member is only in the descriptor, after its data
+        with self.assertRaisesRegex(ExportError, 'Unsupported zip entry'):
+            extract(archive, 7)
+
+    def test_crc_mismatch(self):
+        archive = bytearray(build_zip([('123.nessus', report(1000))], zipfile.ZIP_STORED))
+        # CRC-32 field of the local file header
+        archive[14] ^= 0xFF
+        with self.assertRaisesRegex(ExportError, 'CRC mismatch'):
+            extract(bytes(archive), 7)
+
+    def test_truncated(self):
+        archive = build_zip([('123.nessus', report(20000))])
+        for cut in (10, 40, len(archive) // 2):
+            with self.subTest(cut=cut):
+                with self.assertRaises(ExportError):
+                    extract(archive[:cut], 7)
+
+    def test_no_member(self):
+        with self.assertRaises(ExportError):
+            extract(build_zip([('readme.txt', b'no report')]), 7)
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for pos in range(0, len(self.data), chunk_size):
+            yield self.data[pos:pos + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSC(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def post(self, path, **kwargs):
+        self.calls.append((path, kwargs))
+        self.resp = FakeResponse(self.data)
+        return self.resp
+
+
+class ExportScanToFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def test_download(self):
+        payload = report(100000)
+        sc = FakeSC(build_zip([('7.nessus', payload)]))
+        dest = os.path.join(self.folder, 'scan.nessus')
+
+        exported = export_scan_to_file(sc, 7, dest, chunk_size=1000)
+
+        self.assertEqual(sc.calls, [('scanResult/7/download', dict(json={'downloadType': 'v2'}, stream=True))])
+        self.assertTrue(sc.resp.closed)
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), payload)
+        self.assertEqual(exported['size'], len(payload))
+        self.assertEqual(os.listdir(self.folder), ['scan.nessus'])
+
+    def test_error_body_leaves_nothing(self):
+        sc = FakeSC(b'{"error_code": 146, "error_msg": "Scan result #7 not found"}')
+        dest = os.path.join(self.folder, 'scan.nessus')
+
+        with self.assertRaisesRegex(ExportError, 'error_code'):
+            export_scan_to_file(sc, 7, dest)
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_failed_download_leaves_nothing(self):
+        archive = build_zip([('7.nessus', report(20000))])
+        sc = FakeSC(archive[:len(archive) // 2])
+        dest = os.path.join(self.folder, 'scan.nessus')
+
+        with self.assertRaises(ExportError):
+            export_scan_to_file(sc, 7, dest)
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
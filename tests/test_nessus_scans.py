@@ -0,0 +1,165 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Tests of the target sharding of module_utils/nessus_scans.py: every host
+# of the targets has to land in exactly one shard.
+#
+#   python -m pytest tests
+
+import os
+import unittest
+
+import ansible.module_utils
+
+ansible.module_utils.__path__.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  'module_utils'))
+
+from ansible.module_utils.nessus_sc import NameIndex
+from ansible.module_utils.nessus_scans import create_sharded_scan, shard_targets, split_targets, target_hosts
+
+
+TARGETS = [
+    ['10.0.0.0/22', 'a.example.com'],
+    ['10.0.0.0/24', '10.0.1.10-10.0.1.19', '10.0.2.7', '172.16.0.0/23', '2001:db8::/120',
+     'web1.example.com', 'web2.example.com', 'db1.other.example.org'],
+    ['10.0.0.1', '10.0.0.1', '10.0.0.0/30', 'A.example.com', 'a.example.com'],
+    ['host%d.example.com' % n for n in range(10)],
+    ]
+
+
+def hosts_of(targets):
+    ''' Set of the hosts of targets, ip addresses as (version, number) '''
+    ranges, names = split_targets(targets)
+    hosts = set(names)
+    for version, first, last in ranges:
+        hosts.update((version, n) for n in range(first, last + 1))
+    return hosts
+
+
+class ShardTargetsTest(unittest.TestCase):
+
+    def check(self, targets, shards, shard_by):
+        buckets = shard_targets(targets, shards, shard_by)
+        self.assertLessEqual(len(buckets), shards)
+        self.assertTrue(all(buckets))
+
+        # every host in exactly one shard
+        seen = set()
+        for bucket in buckets:
+            hosts = hosts_of(bucket)
+            self.assertFalse(seen & hosts)
+            seen |= hosts
+        self.assertEqual(seen, hosts_of(targets))
+        self.assertEqual(sum(target_hosts(bucket) for bucket in buckets), target_hosts(targets))
+        return buckets
+
+    def test_host_counts_add_up(self):
+        for targets in TARGETS:
+            for shard_by in ('count', 'subnet'):
+                for shards in (1, 2, 3, 7, 50):
+                    with self.subTest(targets=targets[0], shard_by=shard_by, shards=shards):
+                        self.check(targets, shards, shard_by)
+
+    def test_count_balanced(self):
+        buckets = self.check(['10.0.0.0/22', 'a.example.com'], 3, 'count')
+        self.assertEqual([target_hosts(bucket) for bucket in buckets], [342, 342, 341])
+
+    def test_subnet_keeps_subnets_together(self):
+        buckets = self.check(['10.0.0.0/23', '10.0.2.0/25', 'web1.example.com', 'web2.example.com'], 3, 'subnet')
+        for subnet in (['10.0.0.0/24'], ['10.0.1.0/24'], ['10.0.2.0/25'], ['web1.example.com', 'web2.example.com']):
+            hosts = hosts_of(subnet)
+            self.assertEqual(sum(1 for bucket in buckets if hosts & hosts_of(bucket)), 1)
+
+    def test_target_hosts(self):
+        self.assertEqual(target_hosts(['10.0.0.0/22', 'a.example.com']), 1025)
+        self.assertEqual(target_hosts(['10.0.0.1', '10.0.0.0/30', 'A.example.com', 'a.example.com', '']), 5)
+        self.assertEqual(target_hosts([]), 0)
+
+
+class StubScans(object):
+    ''' sc.scans keeping the scan definitions in memory '''
+
+    def __init__(self):
+        self.scans = {}
+        self.next_id = 100
+
+    def list(self, fields=None):
+        return dict(usable=[dict(id=str(i), name=scan['name']) for i, scan in self.scans.items()])
+
+    def create(self, name, repo, targets=None, scan_zone=None, **kw):
+        self.next_id += 1
+        self.scans[self.next_id] = dict(name=name, ipList=','.join(targets), repository=dict(id=str(repo)),
+                                        zone=dict(id=str(scan_zone or 0)))
+        return dict(id=str(self.next_id))
+
+    def details(self, scan_id, fields=None):
+        return dict(self.scans[scan_id], id=str(scan_id))
+
+    def edit(self, scan_id, targets=None, repo=None, scan_zone=None):
+        scan = self.scans[scan_id]
+        scan.update(ipList=','.join(targets), repository=dict(id=str(repo)))
+        if scan_zone is not None:
+            scan['zone'] = dict(id=str(scan_zone))
+
+    def delete(self, scan_id):
+        del self.scans[scan_id]
+
+
+class StubPolicies(object):
+
+    def list(self, fields=None):
+        return dict(usable=[dict(id='1', name='Discovery')])
+
+
+class StubSC(object):
+
+    def __init__(self):
+        self.scans = StubScans()
+        self.policies = StubPolicies()
+
+
+class CreateShardedScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sc = StubSC()
+
+    def create(self, targets, shards, shard_by='count', repositories=None):
+        definition = dict(scan_name='dc', policy_name='Discovery', targets=targets)
+        return create_sharded_scan(self.sc, NameIndex(self.sc), definition, shards, shard_by,
+                                   repositories=repositories)
+
+    def current(self):
+        ''' {shard name: hosts} of the scans on the stub SC '''
+        return dict((scan['name'], target_hosts(scan['ipList'].split(','))) for scan in self.sc.scans.scans.values())
+
+    def test_hosts(self):
+        statuses = self.create(['10.0.0.0/22', 'a.example.com'], 3)
+        self.assertEqual(dict((name, status['hosts']) for name, status in statuses.items()),
+                         {'dc-shard-1': 342, 'dc-shard-2': 342, 'dc-shard-3': 341})
+        self.assertEqual(set(status['state'] for status in statuses.values()), set(['created']))
+        self.assertEqual(self.current(), {'dc-shard-1': 342, 'dc-shard-2': 342, 'dc-shard-3': 341})
+
+    def test_rerun_unchanged(self):
+        created = self.create(['10.0.0.0/22', 'a.example.com'], 3)
+        statuses = self.create(['10.0.0.0/22', 'a.example.com'], 3)
+        self.assertEqual(set(status['state'] for status in statuses.values()), set(['exists']))
+        self.assertEqual(dict((name, s['scan_id']) for name, s in statuses.items()),
+                         dict((name, s['scan_id']) for name, s in created.items()))
+
+    def test_rerun_edits_changed_shards(self):
+        created = self.create(['10.0.0.0/22', 'a.example.com'], 3)
+        statuses = self.create(['10.0.0.0/22', 'a.example.com'], 3, 'subnet', repositories=[1, 2])
+        self.assertEqual(set(status['state'] for status in statuses.values()), set(['updated']))
+        self.assertEqual(statuses['dc-shard-1']['scan_id'], created['dc-shard-1']['scan_id'])
+        self.assertEqual(self.current(), dict((name, status['hosts']) for name, status in statuses.items()))
+        self.assertEqual(self.sc.scans.details(statuses['dc-shard-2']['scan_id'])['repository'], dict(id='2'))
+
+    def test_fewer_shards_deletes_extra(self):
+        created = self.create(['10.0.0.0/22', 'a.example.com'], 3)
+        statuses = self.create(['10.0.0.0/22', 'a.example.com'], 2)
+        self.assertEqual(statuses['dc-shard-3'], dict(state='deleted', scan_id=created['dc-shard-3']['scan_id']))
+        self.assertEqual(self.current(), {'dc-shard-1': 513, 'dc-shard-2': 512})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# Author: Jesus Rodriguez Fonteboa
+# Grational ltd
+#
+# Tests of the findings database of module_utils/nessus_store.py: scan
+# results loaded from .nessus files and the new, fixed and persisting
+# findings DELTA_QUERY finds between two of them.
+#
+#   python -m pytest tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ansible.module_utils
+
+ansible.module_utils.__path__.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  'module_utils'))
+
+from ansible.module_utils.nessus_store import FindingsStore, store_findings
+
+
+def nessus(findings):
+    ''' .nessus XML of the (host, plugin_id, port, protocol, severity) findings '''
+    hosts = {}
+    for host, plugin_id, port, protocol, severity in findings:
+        hosts.setdefault(host, []).append(
+            '<ReportItem port="%d" svc_name="general" protocol="%s" severity="%d" pluginID="%d" '
+            'pluginName="Plugin %d"><cve>CVE-2020-%04d</cve></ReportItem>' % (
+                port, protocol, severity, plugin_id, plugin_id, plugin_id % 10000))
+    return ('<?xml version="1.0" ?>\n<NessusClientData_v2><Report name="scan">'
+            + ''.join('<ReportHost name="%s"><HostProperties><tag name="host-ip">%s</tag></HostProperties>%s'
+                      '</ReportHost>' % (host, host, ''.join(items)) for host, items in sorted(hosts.items()))
+            + '</Report></NessusClientData_v2>')
+
+
+PREVIOUS = [
+    ('10.0.0.1', 10001, 443, 'tcp', 2),
+    ('10.0.0.1', 10002, 22, 'tcp', 4),
+    ('10.0.0.2', 10001, 443, 'tcp', 2),
+    ('10.0.0.2', 10003, 161, 'udp', 1),
+    ('10.0.0.3', 10004, 0, 'tcp', 3),
+    ]
+
+CURRENT = [
+    # persisting
+    ('10.0.0.1', 10001, 443, 'tcp', 2),
+    ('10.0.0.2', 10001, 443, 'tcp', 2),
+    # new: same plugin on another port, another protocol and another host
+    ('10.0.0.1', 10001, 8443, 'tcp', 2),
+    ('10.0.0.2', 10003, 161, 'tcp', 1),
+    ('10.0.0.4', 10002, 22, 'tcp', 4),
+    ('10.0.0.4', 10005, 80, 'tcp', 0),
+    ]
+
+
+class FindingsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = FindingsStore(os.path.join(self.folder, 'findings.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def load(self, instance_id, finish_time, findings, scan_name='scan'):
+        path = os.path.join(self.folder, str(instance_id) + '.nessus')
+        with open(path, 'w') as f:
+            f.write(nessus(findings))
+        return self.store.load(instance_id, scan_name, finish_time, path)
+
+    def test_delta_counts(self):
+        self.assertEqual(self.load(1, 1000, PREVIOUS), 5)
+        self.assertEqual(self.load(2, 2000, CURRENT), 6)
+        self.assertEqual(self.store.delta(2, 1), dict(previous_id=1, new=4, fixed=3, persisting=2))
+        # the other way round, new and fixed swap
+        self.assertEqual(self.store.delta(1, 2), dict(previous_id=2, new=3, fixed=4, persisting=2))
+
+    def test_delta_findings(self):
+        self.load(1, 1000, PREVIOUS)
+        self.load(2, 2000, CURRENT)
+        delta = self.store.delta(2, 1, limit=10)
+        self.assertEqual([(f['host'], f['plugin_id'], f['port'], f['protocol'], f['severity'])
+                          for f in delta['new_findings']],
+                         [('10.0.0.4', 10002, 22, 'tcp', 4),
+                          ('10.0.0.1', 10001, 8443, 'tcp', 2),
+                          ('10.0.0.2', 10003, 161, 'tcp', 1),
+                          ('10.0.0.4', 10005, 80, 'tcp', 0)])
+        self.assertEqual([(f['host'], f['plugin_id'], f['port'], f['protocol']) for f in delta['fixed_findings']],
+                         [('10.0.0.1', 10002, 22, 'tcp'), ('10.0.0.3', 10004, 0, 'tcp'),
+                          ('10.0.0.2', 10003, 161, 'udp')])
+        self.assertEqual(delta['new_findings'][0]['plugin_name'], 'Plugin 10002')
+
+    def test_delta_limit(self):
+        many = [('10.0.1.%d' % (n % 250), 20000 + n, 443, 'tcp', n % 5) for n in range(1000)]
+        self.load(1, 1000, PREVIOUS)
+        self.load(2, 2000, many)
+        delta = self.store.delta(2, 1, limit=3)
+        self.assertEqual(delta['new'], 1000)
+        self.assertEqual(delta['fixed'], 5)
+        # most severe first, then by host and plugin (hosts compare as text)
+        expected = sorted(((severity, host, plugin_id) for host, plugin_id, _, _, severity in many),
+                          key=lambda f: (-f[0], f[1], f[2]))[:3]
+        self.assertEqual([(f['severity'], f['host'], f['plugin_id']) for f in delta['new_findings']], expected)
+        self.assertEqual(len(delta['fixed_findings']), 3)
+
+    def test_same_instance(self):
+        self.load(1, 1000, PREVIOUS)
+        self.assertEqual(self.store.delta(1, 1), dict(previous_id=1, new=0, fixed=0, persisting=5))
+
+    def test_reload_replaces(self):
+        self.load(1, 1000, PREVIOUS)
+        self.assertEqual(self.load(1, 1500, CURRENT), 6)
+        self.assertEqual(self.store.instance(1), ('scan', 1500, 6))
+
+    def test_previous_instance(self):
+        self.load(5, 2000, PREVIOUS)
+        self.load(3, 1000, PREVIOUS)
+        self.load(4, 2000, PREVIOUS)
+        self.load(9, 500, PREVIOUS, scan_name='other')
+        self.assertEqual(self.store.previous_instance(5), 4)
+        self.assertEqual(self.store.previous_instance(4), 3)
+        self.assertIsNone(self.store.previous_instance(3))
+        self.assertIsNone(self.store.previous_instance(9))
+
+
+class StoreFindingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db = os.path.join(self.folder, 'findings.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def report(self, instance_id, finish_time, findings):
+        path = os.path.join(self.folder, str(instance_id) + '.nessus')
+        with open(path, 'w') as f:
+            f.write(nessus(findings))
+        return dict(scan_id=str(instance_id), finish_time=str(finish_time), output=path)
+
+    def test_store_findings(self):
+        stored = store_findings(self.db, self.report(1, 1000, PREVIOUS), 'scan')
+        self.assertEqual(stored, dict(findings_db=self.db, findings_stored=5, changed=True))
+
+        stored = store_findings(self.db, self.report(2, 2000, CURRENT), 'scan', delta_limit=1)
+        self.assertTrue(stored['changed'])
+        self.assertEqual((stored['delta']['new'], stored['delta']['fixed'], stored['delta']['persisting']), (4, 3, 2))
+        self.assertEqual(len(stored['delta']['new_findings']), 1)
+
+        # same scan result and finish time, not parsed again
+        os.remove(os.path.join(self.folder, '2.nessus'))
+        stored = store_findings(self.db, dict(scan_id='2', finish_time='2000', output=None), 'scan')
+        self.assertFalse(stored['changed'])
+        self.assertEqual(stored['findings_stored'], 6)
+        self.assertNotIn('new_findings', stored['delta'])
+
+
+if __name__ == '__main__':
+    unittest.main()